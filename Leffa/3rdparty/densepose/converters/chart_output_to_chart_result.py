@@ -15,6 +15,56 @@ from . import resample_fine_and_coarse_segm_to_bbox
 from .base import IntTupleBox, make_int_box
 
 
+def _bilinear_source_indices(in_size: int, out_size: int, device: torch.device):
+    """
+    Source indices and weights of bilinear resampling from in_size to out_size,
+    as computed by F.interpolate(mode="bilinear", align_corners=False)
+    """
+    scale = in_size / out_size
+    src = ((torch.arange(out_size, dtype=torch.float32, device=device) + 0.5) * scale - 0.5).clamp(
+        min=0
+    )
+    i0 = src.long()
+    i1 = (i0 + 1).clamp(max=in_size - 1)
+    lambda1 = src - i0
+    lambda0 = 1 - lambda1
+    return i0, i1, lambda0, lambda1
+
+
+def resample_part_tensors_to_bbox(
+    data: torch.Tensor,
+    labels: torch.Tensor,
+) -> torch.Tensor:
+    """
+    Bilinearly resamples part-based estimates to the labels resolution, sampling
+    only the channel of the part each pixel is labeled with. Equivalent to
+    upsampling all the channels and selecting one per pixel, without materializing
+    the C full resolution maps.
+
+    Args:
+        data (tensor [K, C, H, W] of float): K part-based estimates
+        labels (tensor [h, w] of long): labels obtained by resampling segmentation
+            outputs for the given bounding box
+    Return:
+       Resampled estimates - a tensor [K, h, w] of float, 0 on the background
+    """
+    K, C, H, W = data.shape
+    h, w = labels.shape
+    y0, y1, ly0, ly1 = _bilinear_source_indices(H, h, data.device)
+    x0, x1, lx0, lx1 = _bilinear_source_indices(W, w, data.device)
+    flat = data.reshape(K, C * H * W)
+    base = labels * (H * W)
+
+    def gather(rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        index = base + (rows * W)[:, None] + cols[None, :]
+        return flat[:, index]
+
+    top = lx0 * gather(y0, x0) + lx1 * gather(y0, x1)
+    bottom = lx0 * gather(y1, x0) + lx1 * gather(y1, x1)
+    resampled = ly0[:, None] * top + ly1[:, None] * bottom
+    return resampled.masked_fill(labels == 0, 0)
+
+
 def resample_uv_tensors_to_bbox(
     u: torch.Tensor,
     v: torch.Tensor,
@@ -33,16 +83,8 @@ def resample_uv_tensors_to_bbox(
     Return:
        Resampled U and V coordinates - a tensor [2, H, W] of float
     """
-    x, y, w, h = box_xywh_abs
-    w = max(int(w), 1)
-    h = max(int(h), 1)
-    u_bbox = F.interpolate(u, (h, w), mode="bilinear", align_corners=False)
-    v_bbox = F.interpolate(v, (h, w), mode="bilinear", align_corners=False)
-    uv = torch.zeros([2, h, w], dtype=torch.float32, device=u.device)
-    for part_id in range(1, u_bbox.size(1)):
-        uv[0][labels == part_id] = u_bbox[0, part_id][labels == part_id]
-        uv[1][labels == part_id] = v_bbox[0, part_id][labels == part_id]
-    return uv
+    # labels are already resampled to the box size
+    return resample_part_tensors_to_bbox(torch.cat([u, v]).float(), labels)
 
 
 def resample_uv_to_bbox(
@@ -94,7 +136,12 @@ def densepose_chart_predictor_output_to_result(
     box_xywh = make_int_box(boxes_xywh_abs[0])
 
     labels = resample_fine_and_coarse_segm_to_bbox(predictor_output, box_xywh).squeeze(0)
-    uv = resample_uv_to_bbox(predictor_output, labels, box_xywh)
+    # U and V are not predicted in labels only mode
+    uv = (
+        resample_uv_to_bbox(predictor_output, labels, box_xywh)
+        if predictor_output.u is not None
+        else None
+    )
     return DensePoseChartResult(labels=labels, uv=uv)
 
 
@@ -132,29 +179,31 @@ def resample_confidences_to_bbox(
     confidence_names = [
         key for key in confidence_names if getattr(predictor_output, key) is not None
     ]
-    confidence_base = torch.zeros([h, w], dtype=torch.float32, device=predictor_output.u.device)
+    # fine segmentation has as many channels as U and V, and is there in labels only mode
+    n_parts = predictor_output.fine_segm.size(1)
 
+    part_names = [
+        key for key in confidence_names if getattr(predictor_output, key).size(1) == n_parts
+    ]
     # assign data from channels that correspond to the labels
+    if part_names:
+        resampled = resample_part_tensors_to_bbox(
+            torch.cat([getattr(predictor_output, key) for key in part_names]).float(), labels
+        )
+        for key, result in zip(part_names, resampled):
+            confidence_results[key] = result
+
     for key in confidence_names:
-        resampled_confidence = F.interpolate(
-            getattr(predictor_output, key),
+        if key in part_names:
+            continue
+        # confidence is not part-based, fill the data with the first channel
+        # (targeted for segmentation confidences that have only 1 channel)
+        confidence_results[key] = F.interpolate(
+            getattr(predictor_output, key)[:, :1],
             (h, w),
             mode="bilinear",
             align_corners=False,
-        )
-        result = confidence_base.clone()
-        for part_id in range(1, predictor_output.u.size(1)):
-            if resampled_confidence.size(1) != predictor_output.u.size(1):
-                # confidence is not part-based, don't try to fill it part by part
-                continue
-            result[labels == part_id] = resampled_confidence[0, part_id][labels == part_id]
-
-        if resampled_confidence.size(1) != predictor_output.u.size(1):
-            # confidence is not part-based, fill the data with the first channel
-            # (targeted for segmentation confidences that have only 1 channel)
-            result = resampled_confidence[0, 0]
-
-        confidence_results[key] = result
+        )[0, 0]
 
     return confidence_results  # pyre-ignore[7]
 
@@ -183,6 +232,11 @@ def densepose_chart_predictor_output_to_result_with_confidences(
     box_xywh = make_int_box(boxes_xywh_abs[0])
 
     labels = resample_fine_and_coarse_segm_to_bbox(predictor_output, box_xywh).squeeze(0)
-    uv = resample_uv_to_bbox(predictor_output, labels, box_xywh)
+    # U and V are not predicted in labels only mode
+    uv = (
+        resample_uv_to_bbox(predictor_output, labels, box_xywh)
+        if predictor_output.u is not None
+        else None
+    )
     confidences = resample_confidences_to_bbox(predictor_output, labels, box_xywh)
     return DensePoseChartResultWithConfidences(labels=labels, uv=uv, **confidences)
@@ -61,6 +61,8 @@ class DensePoseChartPredictor(nn.Module):
             dim_in, dim_out_patches, kernel_size, stride=2, padding=int(kernel_size / 2 - 1)
         )
         self.scale_factor = cfg.MODEL.ROI_DENSEPOSE_HEAD.UP_SCALE
+        # when set, U and V are neither computed nor interpolated, for callers that only need labels
+        self.labels_only = False
         initialize_module_params(self)
 
     def interp2d(self, tensor_nchw: torch.Tensor):
@@ -86,9 +88,14 @@ class DensePoseChartPredictor(nn.Module):
         Return:
            An instance of DensePoseChartPredictorOutput
         """
+        if self.labels_only:
+            u = v = None
+        else:
+            u = self.interp2d(self.u_lowres(head_outputs))
+            v = self.interp2d(self.v_lowres(head_outputs))
         return DensePoseChartPredictorOutput(
             coarse_segm=self.interp2d(self.ann_index_lowres(head_outputs)),
             fine_segm=self.interp2d(self.index_uv_lowres(head_outputs)),
-            u=self.interp2d(self.u_lowres(head_outputs)),
-            v=self.interp2d(self.v_lowres(head_outputs)),
+            u=u,
+            v=v,
         )
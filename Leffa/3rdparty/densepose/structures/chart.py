@@ -1,7 +1,7 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 
 from dataclasses import dataclass
-from typing import Union
+from typing import Optional, Union
 import torch
 
 
@@ -22,12 +22,13 @@ class DensePoseChartPredictorOutput:
      - C is the number of fine segmentation channels (
          24 fine body parts / background)
      - Hout and Wout are height and width of predictions
+    U and V are None when the predictor runs in labels only mode.
     """
 
     coarse_segm: torch.Tensor
     fine_segm: torch.Tensor
-    u: torch.Tensor
-    v: torch.Tensor
+    u: Optional[torch.Tensor]
+    v: Optional[torch.Tensor]
 
     def __len__(self):
         """
@@ -48,15 +49,15 @@ class DensePoseChartPredictorOutput:
             return DensePoseChartPredictorOutput(
                 coarse_segm=self.coarse_segm[item].unsqueeze(0),
                 fine_segm=self.fine_segm[item].unsqueeze(0),
-                u=self.u[item].unsqueeze(0),
-                v=self.v[item].unsqueeze(0),
+                u=self.u[item].unsqueeze(0) if self.u is not None else None,
+                v=self.v[item].unsqueeze(0) if self.v is not None else None,
             )
         else:
             return DensePoseChartPredictorOutput(
                 coarse_segm=self.coarse_segm[item],
                 fine_segm=self.fine_segm[item],
-                u=self.u[item],
-                v=self.v[item],
+                u=self.u[item] if self.u is not None else None,
+                v=self.v[item] if self.v is not None else None,
             )
 
     def to(self, device: torch.device):
@@ -65,6 +66,6 @@ class DensePoseChartPredictorOutput:
         """
         coarse_segm = self.coarse_segm.to(device)
         fine_segm = self.fine_segm.to(device)
-        u = self.u.to(device)
-        v = self.v.to(device)
+        u = self.u.to(device) if self.u is not None else None
+        v = self.v.to(device) if self.v is not None else None
         return DensePoseChartPredictorOutput(coarse_segm=coarse_segm, fine_segm=fine_segm, u=u, v=v)
@@ -16,18 +16,19 @@ class DensePoseChartResult:
     - labels (tensor [H, W] of long): contains estimated label for each pixel of
         the detection bounding box of size (H, W)
     - uv (tensor [2, H, W] of float): contains estimated U and V coordinates
-        for each pixel of the detection bounding box of size (H, W)
+        for each pixel of the detection bounding box of size (H, W),
+        None when the predictor runs in labels only mode
     """
 
     labels: torch.Tensor
-    uv: torch.Tensor
+    uv: Optional[torch.Tensor]
 
     def to(self, device: torch.device):
         """
         Transfers all tensors to the given device
         """
         labels = self.labels.to(device)
-        uv = self.uv.to(device)
+        uv = self.uv.to(device) if self.uv is not None else None
         return DensePoseChartResult(labels=labels, uv=uv)
 
 
@@ -44,7 +45,7 @@ class DensePoseChartResultWithConfidences:
     """
 
     labels: torch.Tensor
-    uv: torch.Tensor
+    uv: Optional[torch.Tensor]
     sigma_1: Optional[torch.Tensor] = None
     sigma_2: Optional[torch.Tensor] = None
     kappa_u: Optional[torch.Tensor] = None
@@ -64,7 +65,7 @@ class DensePoseChartResultWithConfidences:
 
         return DensePoseChartResultWithConfidences(
             labels=self.labels.to(device),
-            uv=self.uv.to(device),
+            uv=to_device_if_tensor(self.uv),
             sigma_1=to_device_if_tensor(self.sigma_1),
             sigma_2=to_device_if_tensor(self.sigma_2),
             kappa_u=to_device_if_tensor(self.kappa_u),
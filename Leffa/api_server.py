@@ -39,6 +39,7 @@ from leffa.model import LeffaModel
 from leffa.inference import LeffaInference
 from leffa_utils.garment_agnostic_mask_predictor import AutoMasker
 from leffa_utils.densepose_predictor import DensePosePredictor
+from leffa_utils.thread_budget import ThreadBudget
 from leffa_utils.utils import resize_and_center, get_agnostic_mask_hd, get_agnostic_mask_dc
 from preprocess.humanparsing.run_parsing import Parsing
 from preprocess.openpose.run_openpose import OpenPose
@@ -68,14 +69,21 @@ class LeffaAPIPredictor:
     def __init__(self):
         logger.info("Initializing Leffa API Predictor...")
         
+        # Share the CPU cores between the server processes, and within one
+        # process between the ORT, torch and OpenCV pools
+        self.thread_budget = ThreadBudget(
+            num_workers=int(os.environ.get("WEB_CONCURRENCY", 1))).apply()
+
         # Initialize lightweight components
         self.parsing = Parsing(
             atr_path="./ckpts/humanparsing/parsing_atr.onnx",
             lip_path="./ckpts/humanparsing/parsing_lip.onnx",
+            thread_budget=self.thread_budget,
         )
         
         self.openpose = OpenPose(
             body_model_path="./ckpts/openpose/body_pose_model.pth",
+            tryon_keypoints=True,
         )
         
         # Lazy loading for heavy models
@@ -96,6 +104,7 @@ class LeffaAPIPredictor:
                 densepose_path="./ckpts/densepose",
                 schp_path="./ckpts/schp",
                 device=device,
+                densepose_predictor=self.densepose_predictor,
             )
         return self._mask_predictor
     
@@ -106,6 +115,8 @@ class LeffaAPIPredictor:
             self._densepose_predictor = DensePosePredictor(
                 config_path="./ckpts/densepose/densepose_rcnn_R_50_FPN_s1x.yaml",
                 weights_path="./ckpts/densepose/model_final_162be9.pkl",
+                # try-on and pose photos contain one person
+                single_person=True,
             )
         return self._densepose_predictor
     
@@ -201,15 +212,20 @@ class LeffaAPIPredictor:
             
             # Generate DensePose
             if model_type == "viton_hd":
-                densepose_array = self.densepose_predictor.predict_seg(person_array)[:, :, ::-1]
+                densepose_array = self.densepose_predictor.predict_fine_segmentation(person_array)
                 densepose = Image.fromarray(densepose_array)
             else:
-                densepose_array = self.densepose_predictor.predict_iuv(person_array)
-                densepose_seg_array = densepose_array[:, :, 0:1]
-                densepose_seg_array = np.concatenate([densepose_seg_array] * 3, axis=-1)
+                densepose_seg_array = self.densepose_predictor.predict_fine_segmentation(
+                    person_array, colorize=False)
                 densepose = Image.fromarray(densepose_seg_array)
             
-            # Transform data
+            # Select inference model
+            if model_type == "viton_hd":
+                inference = self.vt_inference_hd
+            else:
+                inference = self.vt_inference_dc
+            
+            # Transform data on the model device, inputs are transferred as uint8
             transform = LeffaTransform()
             data = {
                 "src_image": [person_image],
@@ -217,13 +233,7 @@ class LeffaAPIPredictor:
                 "mask": [mask],
                 "densepose": [densepose],
             }
-            data = transform(data)
-            
-            # Select inference model
-            if model_type == "viton_hd":
-                inference = self.vt_inference_hd
-            else:
-                inference = self.vt_inference_dc
+            data = transform.forward_batched(data, device=inference.device)
             
             # Run inference
             output = inference(
@@ -280,7 +290,7 @@ class LeffaAPIPredictor:
             densepose_array = self.densepose_predictor.predict_iuv(target_array)[:, :, ::-1]
             densepose = Image.fromarray(densepose_array)
             
-            # Transform data
+            # Transform data on the model device, inputs are transferred as uint8
             transform = LeffaTransform()
             data = {
                 "src_image": [target_pose_image],  # Target pose as source
@@ -288,7 +298,7 @@ class LeffaAPIPredictor:
                 "mask": [mask],
                 "densepose": [densepose],
             }
-            data = transform(data)
+            data = transform.forward_batched(data, device=self.pt_inference.device)
             
             # Run inference
             output = self.pt_inference(
@@ -9,6 +9,7 @@ from leffa.model import LeffaModel
 from leffa.inference import LeffaInference
 from leffa_utils.garment_agnostic_mask_predictor import AutoMasker
 from leffa_utils.densepose_predictor import DensePosePredictor
+from leffa_utils.thread_budget import ThreadBudget
 from leffa_utils.utils import resize_and_center, list_dir, get_agnostic_mask_hd, get_agnostic_mask_dc, preprocess_garment_image
 from preprocess.humanparsing.run_parsing import Parsing
 from preprocess.openpose.run_openpose import OpenPose
@@ -26,14 +27,19 @@ snapshot_download(repo_id="franciszzj/Leffa", local_dir="./ckpts")
 
 class LeffaPredictor(object):
     def __init__(self):
+        # Share the CPU cores between the ORT, torch and OpenCV pools
+        self.thread_budget = ThreadBudget().apply()
+
         # Initialize lightweight components first
         self.parsing = Parsing(
             atr_path="./ckpts/humanparsing/parsing_atr.onnx",
             lip_path="./ckpts/humanparsing/parsing_lip.onnx",
+            thread_budget=self.thread_budget,
         )
 
         self.openpose = OpenPose(
             body_model_path="./ckpts/openpose/body_pose_model.pth",
+            tryon_keypoints=True,
         )
         
         # Use lazy loading for heavy models
@@ -51,6 +57,7 @@ class LeffaPredictor(object):
                 densepose_path="./ckpts/densepose",
                 schp_path="./ckpts/schp",
                 device=device,
+                densepose_predictor=self.densepose_predictor,
             )
         return self._mask_predictor
     
@@ -60,6 +67,8 @@ class LeffaPredictor(object):
             self._densepose_predictor = DensePosePredictor(
                 config_path="./ckpts/densepose/densepose_rcnn_R_50_FPN_s1x.yaml",
                 weights_path="./ckpts/densepose/model_final_162be9.pkl",
+                # try-on and pose photos contain one person
+                single_person=True,
             )
         return self._densepose_predictor
     
@@ -159,13 +168,12 @@ class LeffaPredictor(object):
 
         if control_type == "virtual_tryon":
             if vt_model_type == "viton_hd":
-                src_image_seg_array = self.densepose_predictor.predict_seg(src_image_array)[:, :, ::-1]
+                src_image_seg_array = self.densepose_predictor.predict_fine_segmentation(src_image_array)
                 src_image_seg = Image.fromarray(src_image_seg_array)
                 densepose = src_image_seg
             elif vt_model_type == "dress_code":
-                src_image_iuv_array = self.densepose_predictor.predict_iuv(src_image_array)
-                src_image_seg_array = src_image_iuv_array[:, :, 0:1]
-                src_image_seg_array = np.concatenate([src_image_seg_array] * 3, axis=-1)
+                src_image_seg_array = self.densepose_predictor.predict_fine_segmentation(
+                    src_image_array, colorize=False)
                 src_image_seg = Image.fromarray(src_image_seg_array)
                 densepose = src_image_seg
         elif control_type == "pose_transfer":
@@ -173,14 +181,6 @@ class LeffaPredictor(object):
             src_image_iuv = Image.fromarray(src_image_iuv_array)
             densepose = src_image_iuv
 
-        transform = LeffaTransform()
-        data = {
-            "src_image": [src_image],
-            "ref_image": [ref_image],
-            "mask": [mask],
-            "densepose": [densepose],
-        }
-        data = transform(data)
         if control_type == "virtual_tryon":
             if vt_model_type == "viton_hd":
                 inference = self.vt_inference_hd
@@ -188,6 +188,16 @@ class LeffaPredictor(object):
                 inference = self.vt_inference_dc
         elif control_type == "pose_transfer":
             inference = self.pt_inference
+
+        transform = LeffaTransform()
+        data = {
+            "src_image": [src_image],
+            "ref_image": [ref_image],
+            "mask": [mask],
+            "densepose": [densepose],
+        }
+        # Normalize on the model device, the inputs are transferred as uint8
+        data = transform.forward_batched(data, device=inference.device)
         try:
             output = inference(
                 data,
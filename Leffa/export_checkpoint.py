@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Export a Leffa checkpoint without the weights that are never used at inference
+"""
+import argparse
+import logging
+
+import torch
+
+from leffa.model import LeffaModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@torch.no_grad()
+def run_unets(model, generator_seed=0, height=64, width=48):
+    # a small latent is enough to compare two models with the same weights
+    generator = torch.Generator().manual_seed(generator_seed)
+    ref_latent = torch.randn(1, model.unet_encoder.config.in_channels, height, width, generator=generator)
+    latent = torch.randn(1, model.unet.config.in_channels, height, width, generator=generator)
+    timestep = torch.tensor([500])
+    _, reference_features = model.unet_encoder(ref_latent, timestep, encoder_hidden_states=None, return_dict=False)
+    noise_pred = model.unet(
+        latent,
+        timestep,
+        encoder_hidden_states=None,
+        cross_attention_kwargs=None,
+        added_cond_kwargs=None,
+        reference_features=list(reference_features),
+        return_dict=False,
+    )[0]
+    return list(reference_features) + [noise_pred]
+
+
+def check_round_trip(model, args):
+    """Rebuilds a LeffaModel from the exported checkpoint and compares it to the exporting one."""
+    exported = LeffaModel(
+        pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        pretrained_model=args.output,
+        dtype="float32",
+        truncate_reference_unet=True,
+    )
+    expected, actual = model.state_dict(), exported.state_dict()
+    assert expected.keys() == actual.keys(), "Exported checkpoint loads into different parameters"
+    for k in expected:
+        assert torch.equal(expected[k], actual[k]), "{} differs after the round trip".format(k)
+    for expected_output, output in zip(run_unets(model.eval()), run_unets(exported.eval())):
+        assert torch.equal(expected_output, output), "UNet outputs differ after the round trip"
+    logger.info("Round trip check passed for {}".format(args.output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--pretrained_model_name_or_path",
+        default="./ckpts/stable-diffusion-inpainting",
+    )
+    parser.add_argument("--pretrained_model", default="./ckpts/virtual_tryon.pth")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--skip_check", action="store_true", help="do not reload the export to compare it")
+    args = parser.parse_args()
+
+    # Keep the checkpoint in float32, LeffaModel casts to float16 on load
+    model = LeffaModel(
+        pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        pretrained_model=args.pretrained_model,
+        dtype="float32",
+        truncate_reference_unet=True,
+    )
+    state_dict = model.state_dict()
+    torch.save(state_dict, args.output)
+    logger.info("Saved {} tensors to {}".format(len(state_dict), args.output))
+    if not args.skip_check:
+        check_round_trip(model, args)
+
+
+if __name__ == "__main__":
+    main()
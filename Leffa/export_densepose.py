@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Export the DensePose R50-FPN as a traced TorchScript model, see TracedDensePoseModel to run it
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import cv2
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "3rdparty"))
+
+from detectron2.export import TracingAdapter
+
+from leffa_utils.densepose_predictor import DensePosePredictor, TracedDensePoseModel, set_labels_only
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def inference(model, inputs):
+    # boxes stay in the resized image, TracedDensePoseModel rescales them like DefaultPredictor
+    instances = model.inference(inputs, do_postprocess=False)[0]
+    densepose = instances.pred_densepose
+    outputs = {
+        "pred_boxes": instances.pred_boxes.tensor,
+        "scores": instances.scores,
+        "pred_classes": instances.pred_classes,
+        "coarse_segm": densepose.coarse_segm,
+        "fine_segm": densepose.fine_segm,
+    }
+    if densepose.u is not None:
+        outputs["u"] = densepose.u
+        outputs["v"] = densepose.v
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config_path", default="./ckpts/densepose/densepose_rcnn_R_50_FPN_s1x.yaml")
+    parser.add_argument("--weights_path", default="./ckpts/densepose/model_final_162be9.pkl")
+    parser.add_argument("--image", required=True, help="a person image, the DensePose head is traced on its detections")
+    parser.add_argument("--output", default="./ckpts/densepose/densepose_rcnn_R_50_FPN_s1x.ts")
+    parser.add_argument("--single_person", action="store_true")
+    parser.add_argument("--min_size_test", type=int, default=None)
+    parser.add_argument("--labels_only", action="store_true", help="leave U and V out of the model")
+    args = parser.parse_args()
+
+    predictor = DensePosePredictor(
+        config_path=args.config_path,
+        weights_path=args.weights_path,
+        single_person=args.single_person,
+        min_size_test=args.min_size_test,
+    ).predictor
+    model = predictor.model.eval()
+    set_labels_only(model, args.labels_only)
+
+    # same preprocessing as DefaultPredictor
+    original_image = cv2.imread(args.image)
+    if predictor.input_format == "RGB":
+        original_image = original_image[:, :, ::-1]
+    image = predictor.aug.get_transform(original_image).apply_image(original_image)
+    image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1)).to(model.device)
+
+    adapter = TracingAdapter(model, [{"image": image}], inference)
+    with torch.no_grad():
+        traced = torch.jit.trace(adapter, adapter.flattened_inputs)
+        outputs = inference(model, [{"image": image}])
+    assert len(outputs["scores"]), "No person detected in {}, the DensePose head would not be traced".format(
+        args.image)
+
+    config = {
+        "min_size_test": predictor.cfg.INPUT.MIN_SIZE_TEST,
+        "max_size_test": predictor.cfg.INPUT.MAX_SIZE_TEST,
+        "input_format": predictor.input_format,
+        # traced code runs on the device it was traced on
+        "device": str(model.device),
+        # the adapter flattens the outputs dict in sorted key order
+        "output_names": adapter.outputs_schema.keys,
+    }
+    torch.jit.save(traced, args.output, _extra_files={"config.json": json.dumps(config)})
+    logger.info("Saved {}".format(args.output))
+
+    # check the artifact against the eager model
+    traced_outputs = TracedDensePoseModel(args.output, model.device)(cv2.imread(args.image))["instances"]
+    eager_outputs = predictor(cv2.imread(args.image))["instances"]
+    max_diff = (traced_outputs.pred_densepose.fine_segm - eager_outputs.pred_densepose.fine_segm).abs().max()
+    logger.info("Max fine segmentation difference to the eager model: {:.3g}".format(max_diff.item()))
+
+
+if __name__ == "__main__":
+    main()
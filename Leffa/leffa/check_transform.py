@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Check that LeffaTransform.forward_batched gives the same model inputs as forward
+"""
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import logging
+
+import numpy as np
+import torch
+from PIL import Image
+
+from leffa.transform import LeffaTransform
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KEYS = ["src_image", "ref_image", "mask", "densepose"]
+
+
+def random_batch(rng, batch_size, width, height):
+    def image(mode, channels):
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        return Image.fromarray(rng.integers(0, 256, size=shape, dtype=np.uint8), mode)
+
+    return {
+        "src_image": [image("RGB", 3) for _ in range(batch_size)],
+        "ref_image": [image("RGB", 3) for _ in range(batch_size)],
+        "mask": [image("L", 1) for _ in range(batch_size)],
+        # densepose labels are 0-24 in the third channel
+        "densepose": [Image.fromarray(np.dstack([
+            rng.integers(0, 256, size=(height, width), dtype=np.uint8),
+            rng.integers(0, 256, size=(height, width), dtype=np.uint8),
+            rng.integers(0, 25, size=(height, width), dtype=np.uint8),
+        ]), "RGB") for _ in range(batch_size)],
+    }
+
+
+def check(name, expected, actual):
+    assert expected.shape == actual.shape, "{}: {} != {}".format(name, tuple(expected.shape), tuple(actual.shape))
+    assert torch.equal(expected, actual.cpu()), "{}: max difference {}".format(
+        name, (expected - actual.cpu()).abs().max().item())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--device", default=None, help="also check the uint8 transfer to this device")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for dataset in ("virtual_tryon", "pose_transfer"):
+        transform = LeffaTransform(args.height, args.width, dataset)
+        # inputs at the model size match everywhere
+        batch = random_batch(rng, args.batch_size, args.width, args.height)
+        expected = transform(dict(batch))
+        actual = transform.forward_batched(dict(batch), args.device)
+        for k in KEYS:
+            check("{} {}".format(dataset, k), expected[k], actual[k])
+        logger.info("{}: forward_batched matches forward".format(dataset))
+
+    # other sizes are only expected to match for the nearest resized pose transfer densepose
+    transform = LeffaTransform(args.height, args.width, "pose_transfer")
+    for width, height in ((args.width // 2, args.height // 2), (args.width * 3 // 4 + 1, args.height * 5 // 8 + 3),
+                          (args.width + 131, args.height + 77)):
+        batch = random_batch(rng, args.batch_size, width, height)
+        expected = transform(dict(batch))
+        actual = transform.forward_batched(dict(batch), args.device)
+        check("pose_transfer densepose from {}x{}".format(width, height), expected["densepose"], actual["densepose"])
+        logger.info("pose_transfer densepose resized from {}x{} matches forward".format(width, height))
+
+
+if __name__ == "__main__":
+    main()
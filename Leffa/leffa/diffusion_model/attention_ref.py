@@ -361,6 +361,10 @@ class BasicTransformerBlock(nn.Module):
         reference_features = []
         reference_features.append(norm_hidden_states)
 
+        # Nothing after the reference feature is consumed in truncated mode
+        if getattr(self, "truncate_output", None):
+            return hidden_states, reference_features
+
         # 1. Retrieve lora scale.
         lora_scale = (
             cross_attention_kwargs.get("scale", 1.0)
@@ -467,6 +467,11 @@ class Transformer2DModel(ModelMixin, ConfigMixin):
                     class_labels=class_labels,
                 )
             reference_features += out_reference_features
+        # The output projection only feeds the truncated tail
+        if getattr(self, "truncate_output", None):
+            if not return_dict:
+                return (hidden_states,), reference_features
+            return Transformer2DModelOutput(sample=hidden_states), reference_features
         # 3. Output
         if self.is_input_continuous:
             if not self.use_linear_projection:
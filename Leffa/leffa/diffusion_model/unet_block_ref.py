@@ -2520,7 +2520,7 @@ class CrossAttnUpBlock2D(nn.Module):
                 )
                 hidden_states = hidden_states[0]
             reference_features += out_reference_features
-        if self.upsamplers is not None:
+        if self.upsamplers is not None and not getattr(self, "truncate_output", None):
             for upsampler in self.upsamplers:
                 hidden_states = upsampler(
                     hidden_states, upsample_size, scale=lora_scale
@@ -944,6 +944,83 @@ class UNet2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMixin)
         if self.original_attn_processors is not None:
             self.set_attn_processor(self.original_attn_processors)
 
+    def enable_truncated_forward(self):
+        r"""
+        Stops the forward pass right after the last reference feature is collected.
+
+        `LeffaPipeline` only consumes the reference features of the reference UNet, so the rest of the last
+        transformer block, its output projection, the upsampler and any up block behind it are skipped. In this mode
+        the returned `sample` is not meaningful.
+        """
+        reference_up_block_ids = [
+            i
+            for i, upsample_block in enumerate(self.up_blocks)
+            if getattr(upsample_block, "has_cross_attention", False)
+        ]
+        if len(reference_up_block_ids) == 0:
+            raise ValueError(
+                "`enable_truncated_forward()` requires at least one up block with attention."
+            )
+        self.last_reference_up_block_idx = reference_up_block_ids[-1]
+
+        last_up_block = self.up_blocks[self.last_reference_up_block_idx]
+        last_attention = last_up_block.attentions[-1]
+        for module in [
+            self,
+            last_up_block,
+            last_attention,
+            last_attention.transformer_blocks[-1],
+        ]:
+            setattr(module, "truncate_output", True)
+
+    def disable_truncated_forward(self):
+        """Disables the truncated forward pass."""
+        for module in self.modules():
+            if getattr(module, "truncate_output", None) is not None:
+                setattr(module, "truncate_output", None)
+
+    def prune_truncated_tail(self) -> List[str]:
+        r"""
+        Deletes the modules that are never run by the truncated forward pass, so they are dropped from memory and from
+        saved checkpoints. Must be called after [`enable_truncated_forward`], and cannot be undone.
+
+        Returns:
+            `List[str]`: The names of the pruned modules.
+        """
+        if not getattr(self, "truncate_output", None):
+            raise ValueError(
+                "Call `enable_truncated_forward()` before `prune_truncated_tail()`."
+            )
+        up_block_idx = self.last_reference_up_block_idx
+        last_up_block = self.up_blocks[up_block_idx]
+        attention_idx = len(last_up_block.attentions) - 1
+        last_attention = last_up_block.attentions[attention_idx]
+        block_idx = len(last_attention.transformer_blocks) - 1
+
+        attention_prefix = f"up_blocks.{up_block_idx}.attentions.{attention_idx}"
+        block_prefix = f"{attention_prefix}.transformer_blocks.{block_idx}"
+        pruned_modules = {
+            block_prefix: ["attn1", "norm2", "attn2", "norm3", "ff"],
+            attention_prefix: ["proj_out"],
+            f"up_blocks.{up_block_idx}": ["upsamplers"],
+            "": ["conv_norm_out", "conv_act", "conv_out"],
+        }
+
+        pruned_names = []
+        modules = dict(self.named_modules())
+        for prefix, names in pruned_modules.items():
+            parent = modules[prefix]
+            for name in names:
+                if getattr(parent, name, None) is not None:
+                    setattr(parent, name, None)
+                    pruned_names.append(f"{prefix}.{name}" if prefix else name)
+
+        while len(self.up_blocks) > up_block_idx + 1:
+            pruned_names.append(f"up_blocks.{len(self.up_blocks) - 1}")
+            del self.up_blocks[-1]
+
+        return pruned_names
+
     def forward(
         self,
         sample: torch.FloatTensor,
@@ -1371,6 +1448,13 @@ class UNet2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMixin)
                     scale=lora_scale,
                 )
 
+            # All reference features have been collected
+            if (
+                getattr(self, "truncate_output", None)
+                and i == self.last_reference_up_block_idx
+            ):
+                break
+
         if not return_dict:
             return (sample,), reference_features
 
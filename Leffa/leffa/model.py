@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from diffusers import AutoencoderKL, DDPMScheduler
+from diffusers.models.attention_processor import Attention
 
 from leffa.diffusion_model.unet_ref import (
     UNet2DConditionModel as ReferenceUNet,
@@ -24,6 +25,7 @@ class LeffaModel(nn.Module):
         height: int = 1024,
         width: int = 768,
         dtype: str = "float16",
+        truncate_reference_unet: bool = True,
     ):
         super().__init__()
 
@@ -34,6 +36,7 @@ class LeffaModel(nn.Module):
             pretrained_model_name_or_path,
             pretrained_model,
             new_in_channels,
+            truncate_reference_unet,
         )
 
         if dtype == "float16":
@@ -44,6 +47,7 @@ class LeffaModel(nn.Module):
         pretrained_model_name_or_path: str = "",
         pretrained_model: str = "",
         new_in_channels: int = 12,
+        truncate_reference_unet: bool = True,
     ):
         diffusion_model_type = ""
         if "stable-diffusion-inpainting" in pretrained_model_name_or_path:
@@ -119,13 +123,32 @@ class LeffaModel(nn.Module):
         remove_cross_attention(self.unet)
         remove_cross_attention(self.unet_encoder, model_type="unet_encoder")
 
+        # Truncate Reference UNet, only its reference features are used
+        pruned_modules = []
+        if truncate_reference_unet:
+            self.unet_encoder.enable_truncated_forward()
+            pruned_modules = [
+                "unet_encoder.{}".format(name)
+                for name in self.unet_encoder.prune_truncated_tail()
+            ]
+
+        # Drop the skipped cross attention weights, before loading so that
+        # checkpoints saved with or without them both load
+        strip_cross_attention(self.unet)
+        strip_cross_attention(self.unet_encoder)
+
         # Load pretrained model
         if pretrained_model != "" and pretrained_model is not None:
-            self.load_state_dict(torch.load(
-                pretrained_model, map_location="cpu"))
+            state_dict = torch.load(pretrained_model, map_location="cpu")
+            state_dict = remove_pruned_weights(state_dict, pruned_modules)
+            self.load_state_dict(state_dict)
             logger.info(
                 "Load pretrained model from {}".format(pretrained_model))
 
+        # Fuse self attention q, k, v projections into one GEMM
+        fuse_self_attention_projections(self.unet)
+        fuse_self_attention_projections(self.unet_encoder)
+
     def replace_conv_in_layer(self, unet_model, new_in_channels):
         original_conv_in = unet_model.conv_in
 
@@ -185,6 +208,16 @@ class LeffaModel(nn.Module):
         return latent
 
 
+def remove_pruned_weights(state_dict, pruned_modules):
+    # Full checkpoints still carry the weights of pruned modules
+    pruned_prefixes = tuple("{}.".format(name) for name in pruned_modules)
+    if len(pruned_prefixes) == 0:
+        return state_dict
+    return {
+        k: v for k, v in state_dict.items() if not k.startswith(pruned_prefixes)
+    }
+
+
 class SkipAttnProcessor(torch.nn.Module):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__()
@@ -200,6 +233,56 @@ class SkipAttnProcessor(torch.nn.Module):
         return hidden_states
 
 
+class SkipAttention(torch.nn.Module):
+    """
+    Parameter-free replacement for an `attn2` whose processor is `SkipAttnProcessor`.
+    Returns its input unchanged, so the transformer block still adds it to the residual.
+    """
+
+    def forward(
+        self,
+        hidden_states,
+        encoder_hidden_states=None,
+        attention_mask=None,
+        **cross_attention_kwargs,
+    ):
+        return hidden_states
+
+    def _load_from_state_dict(
+        self,
+        state_dict,
+        prefix,
+        local_metadata,
+        strict,
+        missing_keys,
+        unexpected_keys,
+        error_msgs,
+    ):
+        # Checkpoints saved before stripping still carry the unused attn2
+        # weights, ignore them instead of reporting unexpected keys.
+        pass
+
+
+def strip_cross_attention(unet):
+    stripped_blocks = []
+    for module in unet.modules():
+        attn2 = getattr(module, "attn2", None)
+        if isinstance(attn2, Attention) and isinstance(
+            attn2.processor, SkipAttnProcessor
+        ):
+            stripped_blocks.append(module)
+
+    for module in stripped_blocks:
+        module.attn2 = SkipAttention()
+    if len(stripped_blocks) > 0:
+        logger.info(
+            "Stripped {} cross attention layers from {}".format(
+                len(stripped_blocks), unet.__class__.__name__
+            )
+        )
+    return stripped_blocks
+
+
 def remove_cross_attention(
     unet,
     cross_attn_cls=SkipAttnProcessor,
@@ -310,17 +393,8 @@ class AttnProcessor2_0(torch.nn.Module):
                 1, 2
             )
 
-        query = attn.to_q(hidden_states)
-
-        if encoder_hidden_states is None:
-            encoder_hidden_states = hidden_states
-        elif attn.norm_cross:
-            encoder_hidden_states = attn.norm_encoder_hidden_states(
-                encoder_hidden_states
-            )
-
-        key = attn.to_k(encoder_hidden_states)
-        value = attn.to_v(encoder_hidden_states)
+        query, key, value = self.project_qkv(
+            attn, hidden_states, encoder_hidden_states)
 
         inner_dim = key.shape[-1]
         head_dim = inner_dim // attn.heads
@@ -359,3 +433,112 @@ class AttnProcessor2_0(torch.nn.Module):
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
+
+    def project_qkv(self, attn, hidden_states, encoder_hidden_states=None):
+        query = attn.to_q(hidden_states)
+
+        if encoder_hidden_states is None:
+            encoder_hidden_states = hidden_states
+        elif attn.norm_cross:
+            encoder_hidden_states = attn.norm_encoder_hidden_states(
+                encoder_hidden_states
+            )
+
+        key = attn.to_k(encoder_hidden_states)
+        value = attn.to_v(encoder_hidden_states)
+        return query, key, value
+
+
+class FusedAttnProcessor2_0(AttnProcessor2_0):
+    r"""
+    Self-attention processor using the packed `to_qkv` projection created by `fuse_self_attention_projections`.
+    """
+
+    def project_qkv(self, attn, hidden_states, encoder_hidden_states=None):
+        if encoder_hidden_states is not None:
+            raise ValueError(
+                "FusedAttnProcessor2_0 only supports self attention."
+            )
+        query, key, value = attn.to_qkv(hidden_states).chunk(3, dim=-1)
+        return query, key, value
+
+
+QKV_PROJECTIONS = ("to_q", "to_k", "to_v")
+
+
+def _unfuse_qkv_state_dict_hook(module, state_dict, prefix, local_metadata):
+    # Save to_qkv as to_q, to_k, to_v to keep checkpoints compatible
+    for param_name in ["weight", "bias"]:
+        fused_key = "{}to_qkv.{}".format(prefix, param_name)
+        if fused_key not in state_dict:
+            continue
+        params = state_dict.pop(fused_key).chunk(3, dim=0)
+        for projection, param in zip(QKV_PROJECTIONS, params):
+            state_dict["{}{}.{}".format(prefix, projection, param_name)] = param
+    return state_dict
+
+
+def _fuse_qkv_load_state_dict_pre_hook(
+    module,
+    state_dict,
+    prefix,
+    local_metadata,
+    strict,
+    missing_keys,
+    unexpected_keys,
+    error_msgs,
+):
+    for param_name in ["weight", "bias"]:
+        keys = [
+            "{}{}.{}".format(prefix, projection, param_name)
+            for projection in QKV_PROJECTIONS
+        ]
+        if all(key in state_dict for key in keys):
+            state_dict["{}to_qkv.{}".format(prefix, param_name)] = torch.cat(
+                [state_dict.pop(key) for key in keys], dim=0
+            )
+
+
+def fuse_self_attention_projections(unet):
+    fused_attentions = []
+    for module in unet.modules():
+        if (
+            isinstance(module, Attention)
+            and type(module.processor) is AttnProcessor2_0
+            and not module.is_cross_attention
+        ):
+            fused_attentions.append(module)
+
+    for attn in fused_attentions:
+        projections = [getattr(attn, projection)
+                       for projection in QKV_PROJECTIONS]
+        has_bias = projections[0].bias is not None
+        to_qkv = nn.Linear(
+            projections[0].in_features,
+            sum(projection.out_features for projection in projections),
+            bias=has_bias,
+            device=projections[0].weight.device,
+            dtype=projections[0].weight.dtype,
+        )
+        with torch.no_grad():
+            to_qkv.weight.copy_(
+                torch.cat([projection.weight for projection in projections]))
+            if has_bias:
+                to_qkv.bias.copy_(
+                    torch.cat([projection.bias for projection in projections]))
+
+        attn.to_qkv = to_qkv
+        for projection in QKV_PROJECTIONS:
+            setattr(attn, projection, None)
+        attn.fused_projections = True
+        attn.set_processor(
+            FusedAttnProcessor2_0(
+                layer_name=attn.processor.layer_name,
+                model_type=attn.processor.model_type,
+            )
+        )
+        attn._register_state_dict_hook(_unfuse_qkv_state_dict_hook)
+        attn._register_load_state_dict_pre_hook(
+            _fuse_qkv_load_state_dict_pre_hook, with_module=True
+        )
+    return fused_attentions
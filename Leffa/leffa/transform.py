@@ -1,9 +1,11 @@
 import logging
+import threading
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Union
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from diffusers.image_processor import VaeImageProcessor
 from PIL import Image
 from torch import nn
@@ -86,6 +88,58 @@ class LeffaTransform(nn.Module):
 
         return batch
 
+    def forward_batched(
+        self, batch: Dict[str, Any], device: Optional[Union[str, torch.device]] = None
+    ) -> Dict[str, Any]:
+        """
+        Vectorized `forward` for stacked uint8 inputs: images and densepose of shape (B, H, W, 3), masks of shape
+        (B, H, W), (B, H, W, 1) or (B, H, W, 3). Lists of PIL images or arrays are stacked first.
+        Inputs already at (height, width) give the same result as `forward`, other sizes are resized with antialiased
+        bilinear instead of PIL lanczos, except the pose transfer densepose whose nearest resize matches `forward`.
+        If `device` is given, the inputs are moved there as uint8 and normalized on that device.
+        """
+        stacked_batch = self.stack_batch(batch)
+        if device is not None:
+            stacked_batch = transfer_uint8_batch(stacked_batch, device)
+        batch.update(self.normalize_batch(stacked_batch))
+        return batch
+
+    @staticmethod
+    def stack_batch(batch: Dict[str, Any]) -> Dict[str, torch.Tensor]:
+        """
+        Stacks the inputs into uint8 tensors of shape (B, C, H, W) without converting them to float.
+        """
+        return {
+            "src_image": stack_uint8(batch["src_image"], "RGB"),
+            "ref_image": stack_uint8(batch["ref_image"], "RGB"),
+            "mask": stack_uint8(batch["mask"], "L"),
+            "densepose": stack_uint8(batch["densepose"], "RGB"),
+        }
+
+    def normalize_batch(self, batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """
+        Turns the uint8 (B, C, H, W) tensors of `stack_batch` into model inputs on their current device.
+        """
+        size = (self.height, self.width)
+        src_image = normalize_image(resize_batch(batch["src_image"], size))
+        ref_image = normalize_image(resize_batch(batch["ref_image"], size))
+        mask = batch["mask"]
+        if mask.shape[1] == 3:
+            mask = rgb_to_grayscale(mask)
+        mask = binarize_mask(resize_batch(mask, size))
+        if self.dataset in ["pose_transfer"]:
+            densepose = normalize_densepose(
+                resize_batch(batch["densepose"], size, mode="nearest")
+            )
+        else:
+            densepose = normalize_image(resize_batch(batch["densepose"], size))
+        return {
+            "src_image": src_image,
+            "ref_image": ref_image,
+            "mask": mask,
+            "densepose": densepose,
+        }
+
     @staticmethod
     def prepare_image(image):
         if isinstance(image, torch.Tensor):
@@ -176,3 +230,119 @@ class LeffaTransform(nn.Module):
             densepose = torch.from_numpy(densepose).to(
                 dtype=torch.float32) * 2.0 - 1.0
         return densepose
+
+
+def stack_uint8(images, mode="RGB"):
+    if isinstance(images, (list, tuple)):
+        images = np.stack(
+            [
+                np.asarray(i.convert(mode)) if isinstance(i, Image.Image) else np.asarray(i)
+                for i in images
+            ]
+        )
+    if isinstance(images, np.ndarray):
+        images = torch.from_numpy(np.ascontiguousarray(images))
+    if images.dtype != torch.uint8:
+        raise ValueError(f"Expected uint8 images, got {images.dtype}.")
+    if images.ndim == 3:
+        images = images.unsqueeze(-1)
+    return images.permute(0, 3, 1, 2)
+
+
+class StagingBuffer(object):
+    """
+    Page-locked host buffer reused by every CUDA transfer, pinning memory costs more than the copy.
+    It grows to the largest batch seen. The copy out of it is asynchronous, so the next transfer
+    waits for the previous one to finish before writing into it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffer = None
+        self.copied = None
+
+    def transfer(self, tensors, device):
+        numel = sum(v.numel() for v in tensors.values())
+        with self.lock:
+            if self.copied is not None:
+                self.copied.synchronize()
+            if self.buffer is None or self.buffer.numel() < numel:
+                self.buffer = torch.empty(numel, dtype=torch.uint8, pin_memory=True)
+            buffer = self.buffer[:numel]
+            offset = 0
+            for v in tensors.values():
+                buffer[offset: offset + v.numel()].view(v.shape).copy_(v)
+                offset += v.numel()
+            buffer = buffer.to(device, non_blocking=True)
+            self.copied = torch.cuda.Event()
+            self.copied.record(torch.cuda.current_stream(device))
+        return buffer
+
+
+staging_buffer = StagingBuffer()
+
+
+def transfer_uint8_batch(batch, device):
+    """
+    Moves uint8 (B, C, H, W) tensors to `device` through one contiguous host buffer, the shared
+    pinned `staging_buffer` for CUDA.
+    """
+    device = torch.device(device)
+    if device.type == "cpu":
+        return batch
+
+    # Pack in (B, H, W, C) order, which is how stack_uint8 holds the data
+    tensors = {k: v.permute(0, 2, 3, 1) for k, v in batch.items()}
+    if device.type == "cuda":
+        buffer = staging_buffer.transfer(tensors, device)
+    else:
+        buffer = torch.cat([v.reshape(-1) for v in tensors.values()]).to(device)
+
+    outputs = {}
+    offset = 0
+    for k, v in tensors.items():
+        outputs[k] = (
+            buffer[offset: offset + v.numel()]
+            .view(v.shape)
+            .permute(0, 3, 1, 2)
+            .contiguous()
+        )
+        offset += v.numel()
+    return outputs
+
+
+def rgb_to_grayscale(images):
+    # Same integer weights as PIL's convert("L")
+    images = images.to(torch.int32)
+    gray = (
+        images[:, 0:1] * 19595 + images[:, 1:2] * 38470 + images[:, 2:3] * 7471 + 0x8000
+    ) >> 16
+    return gray.to(torch.uint8)
+
+
+def resize_batch(images, size, mode="bilinear"):
+    if tuple(images.shape[-2:]) == tuple(size):
+        return images
+    if mode == "nearest":
+        # "nearest-exact" samples the pixel centers like PIL's Image.NEAREST, "nearest" is off by half a pixel
+        return F.interpolate(images, size=size, mode="nearest-exact")
+    images = F.interpolate(
+        images.to(torch.float32), size=size, mode=mode, align_corners=False, antialias=True
+    )
+    return images.round().clamp(0, 255).to(torch.uint8)
+
+
+def normalize_image(images):
+    images = images.to(torch.float32) / 255.0
+    return 2.0 * images - 1.0
+
+
+def binarize_mask(masks):
+    masks = masks.to(torch.float32) / 255.0
+    return (masks >= 0.5).to(torch.float32)
+
+
+def normalize_densepose(densepose):
+    densepose = densepose.to(torch.float32)
+    scale = densepose.new_tensor([255.0, 255.0, 24.0]).view(1, 3, 1, 1)
+    return densepose / scale * 2.0 - 1.0
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Check that get_agnostic_mask_hd/_dc give the same masks as the original per label implementation
+"""
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import logging
+
+import cv2
+import numpy as np
+import torch
+from numpy.linalg import lstsq
+from PIL import Image, ImageDraw
+
+from leffa_utils.utils import (
+    below_shoulder_line,
+    dilate_mask,
+    erode_mask,
+    extend_arm_mask,
+    get_agnostic_mask_dc,
+    get_agnostic_mask_hd,
+    hole_fill,
+    label_map,
+    refine_mask,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ["upper_body", "lower_body", "dresses"]
+# (width, height): height <= 256, 257-512 and > 512 take different dilations in the DC mask
+SIZES = [(192, 256), (288, 384), (384, 512), (576, 768), (768, 1024)]
+
+
+# the original implementations, before the label lookup tables
+
+
+def reference_get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model_type="hd"):
+    # model_type = "hd"
+    ##############################
+    width, height = size
+    im_parse = model_parse.resize((width, height), Image.NEAREST)
+    parse_array = np.array(im_parse)
+
+    if model_type == 'hd':
+        arm_width = 60
+    elif model_type == 'dc':
+        arm_width = 45
+    else:
+        raise ValueError("model_type must be \'hd\' or \'dc\'!")
+
+    parse_head = (parse_array == 1).astype(np.float32) + \
+                 (parse_array == 3).astype(np.float32) + \
+                 (parse_array == 11).astype(np.float32)
+
+    parser_mask_fixed = (parse_array == label_map["left_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["hat"]).astype(np.float32) + \
+                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
+                        (parse_array == label_map["bag"]).astype(np.float32)
+
+    parser_mask_changeable = (
+        parse_array == label_map["background"]).astype(np.float32)
+
+    arms_left = (parse_array == 14).astype(np.float32)
+    arms_right = (parse_array == 15).astype(np.float32)
+
+    if category == 'dresses':
+        parse_mask = (parse_array == 7).astype(np.float32) + \
+                     (parse_array == 4).astype(np.float32) + \
+                     (parse_array == 5).astype(np.float32) + \
+                     (parse_array == 6).astype(np.float32)
+
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+
+    elif category == 'upper_body':
+        parse_mask = (parse_array == 4).astype(np.float32) + \
+            (parse_array == 7).astype(np.float32)
+        parser_mask_fixed_lower_cloth = (parse_array == label_map["skirt"]).astype(np.float32) + \
+                                        (parse_array == label_map["pants"]).astype(
+                                            np.float32)
+        parser_mask_fixed += parser_mask_fixed_lower_cloth
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+    elif category == 'lower_body':
+        parse_mask = (parse_array == 6).astype(np.float32) + \
+                     (parse_array == 12).astype(np.float32) + \
+                     (parse_array == 13).astype(np.float32) + \
+                     (parse_array == 5).astype(np.float32)
+        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
+                             (parse_array == 14).astype(np.float32) + \
+                             (parse_array == 15).astype(np.float32)
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+    else:
+        raise NotImplementedError
+
+    # Load pose points
+    pose_data = keypoint["pose_keypoints_2d"]
+    pose_data = np.array(pose_data)
+    pose_data = pose_data.reshape((-1, 2))
+
+    im_arms_left = Image.new('L', (width, height))
+    im_arms_right = Image.new('L', (width, height))
+    arms_draw_left = ImageDraw.Draw(im_arms_left)
+    arms_draw_right = ImageDraw.Draw(im_arms_right)
+    if category == 'dresses' or category == 'upper_body':
+        shoulder_right = np.multiply(tuple(pose_data[2][:2]), height / 512.0)
+        shoulder_left = np.multiply(tuple(pose_data[5][:2]), height / 512.0)
+        elbow_right = np.multiply(tuple(pose_data[3][:2]), height / 512.0)
+        elbow_left = np.multiply(tuple(pose_data[6][:2]), height / 512.0)
+        wrist_right = np.multiply(tuple(pose_data[4][:2]), height / 512.0)
+        wrist_left = np.multiply(tuple(pose_data[7][:2]), height / 512.0)
+        ARM_LINE_WIDTH = int(arm_width / 512 * height)
+        size_left = [shoulder_left[0] - ARM_LINE_WIDTH // 2, shoulder_left[1] - ARM_LINE_WIDTH //
+                     2, shoulder_left[0] + ARM_LINE_WIDTH // 2, shoulder_left[1] + ARM_LINE_WIDTH // 2]
+        size_right = [shoulder_right[0] - ARM_LINE_WIDTH // 2, shoulder_right[1] - ARM_LINE_WIDTH // 2, shoulder_right[0] + ARM_LINE_WIDTH // 2,
+                      shoulder_right[1] + ARM_LINE_WIDTH // 2]
+
+        if wrist_right[0] <= 1. and wrist_right[1] <= 1.:
+            im_arms_right = arms_right
+        else:
+            wrist_right = extend_arm_mask(wrist_right, elbow_right, 1.2)
+            arms_draw_right.line(np.concatenate((shoulder_right, elbow_right, wrist_right)).astype(
+                np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
+            arms_draw_right.arc(size_right, 0, 360,
+                                'white', ARM_LINE_WIDTH // 2)
+
+        if wrist_left[0] <= 1. and wrist_left[1] <= 1.:
+            im_arms_left = arms_left
+        else:
+            wrist_left = extend_arm_mask(wrist_left, elbow_left, 1.2)
+            arms_draw_left.line(np.concatenate((wrist_left, elbow_left, shoulder_left)).astype(
+                np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
+            arms_draw_left.arc(size_left, 0, 360, 'white', ARM_LINE_WIDTH // 2)
+
+        hands_left = np.logical_and(np.logical_not(im_arms_left), arms_left)
+        hands_right = np.logical_and(np.logical_not(im_arms_right), arms_right)
+        parser_mask_fixed += hands_left + hands_right
+
+    parser_mask_fixed = cv2.erode(parser_mask_fixed, np.ones(
+        (5, 5), np.uint16), iterations=1)
+
+    parser_mask_fixed = np.logical_or(parser_mask_fixed, parse_head)
+    parse_mask = cv2.dilate(parse_mask, np.ones(
+        (10, 10), np.uint16), iterations=5)
+    if category == 'dresses' or category == 'upper_body':
+        neck_mask = (parse_array == 18).astype(np.float32)
+        neck_mask = cv2.dilate(neck_mask, np.ones(
+            (5, 5), np.uint16), iterations=1)
+        neck_mask = np.logical_and(neck_mask, np.logical_not(parse_head))
+        parse_mask = np.logical_or(parse_mask, neck_mask)
+        arm_mask = cv2.dilate(np.logical_or(im_arms_left, im_arms_right).astype(
+            'float32'), np.ones((5, 5), np.uint16), iterations=4)
+        parse_mask += np.logical_or(parse_mask, arm_mask)
+
+    parse_mask = np.logical_and(
+        parser_mask_changeable, np.logical_not(parse_mask))
+
+    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
+    inpaint_mask = 1 - parse_mask_total
+    img = np.where(inpaint_mask, 255, 0)
+    dst = hole_fill(img.astype(np.uint8))
+    dst = refine_mask(dst)
+    inpaint_mask = dst / 255 * 1
+    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+
+    return mask
+
+
+def reference_get_agnostic_mask_dc(model_parse, keypoint, category, size=(384, 512)):
+    parse_array = np.array(model_parse)
+    pose_data = keypoint["pose_keypoints_2d"]
+    pose_data = np.array(pose_data)
+    pose_data = pose_data.reshape((-1, 2))
+
+    parse_shape = (parse_array > 0).astype(np.float32)
+
+    parse_head = (parse_array == 1).astype(np.float32) + \
+        (parse_array == 2).astype(np.float32) + \
+        (parse_array == 3).astype(np.float32) + \
+        (parse_array == 11).astype(np.float32) + \
+        (parse_array == 18).astype(np.float32)
+
+    parser_mask_fixed = (parse_array == label_map["hair"]).astype(np.float32) + \
+                        (parse_array == label_map["left_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["hat"]).astype(np.float32) + \
+                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
+                        (parse_array == label_map["scarf"]).astype(np.float32) + \
+                        (parse_array == label_map["bag"]).astype(np.float32)
+
+    parser_mask_changeable = (
+        parse_array == label_map["background"]).astype(np.float32)
+
+    arms = (parse_array == 14).astype(np.float32) + \
+        (parse_array == 15).astype(np.float32)
+
+    if category == 'dresses':
+        label_cat = 7
+        parse_mask = (parse_array == 7).astype(np.float32) + \
+            (parse_array == 12).astype(np.float32) + \
+            (parse_array == 13).astype(np.float32)
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+
+    elif category == 'upper_body':
+        label_cat = 4
+        parse_mask = (parse_array == 4).astype(np.float32)
+
+        parser_mask_fixed += (parse_array == label_map["skirt"]).astype(np.float32) + \
+            (parse_array == label_map["pants"]).astype(np.float32)
+
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+    elif category == 'lower_body':
+        label_cat = 6
+        parse_mask = (parse_array == 6).astype(np.float32) + \
+            (parse_array == 12).astype(np.float32) + \
+            (parse_array == 13).astype(np.float32)
+
+        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
+            (parse_array == 14).astype(np.float32) + \
+            (parse_array == 15).astype(np.float32)
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+
+    parse_head = torch.from_numpy(parse_head)  # [0,1]
+    parse_mask = torch.from_numpy(parse_mask)  # [0,1]
+    parser_mask_fixed = torch.from_numpy(parser_mask_fixed)
+    parser_mask_changeable = torch.from_numpy(parser_mask_changeable)
+
+    # dilation
+    parse_without_cloth = np.logical_and(
+        parse_shape, np.logical_not(parse_mask))
+    parse_mask = parse_mask.cpu().numpy()
+
+    width = size[0]
+    height = size[1]
+
+    im_arms = Image.new('L', (width, height))
+    arms_draw = ImageDraw.Draw(im_arms)
+    if category == 'dresses' or category == 'upper_body':
+        shoulder_right = tuple(np.multiply(pose_data[2, :2], height / 512.0))
+        shoulder_left = tuple(np.multiply(pose_data[5, :2], height / 512.0))
+        elbow_right = tuple(np.multiply(pose_data[3, :2], height / 512.0))
+        elbow_left = tuple(np.multiply(pose_data[6, :2], height / 512.0))
+        wrist_right = tuple(np.multiply(pose_data[4, :2], height / 512.0))
+        wrist_left = tuple(np.multiply(pose_data[7, :2], height / 512.0))
+        if wrist_right[0] <= 1. and wrist_right[1] <= 1.:
+            if elbow_right[0] <= 1. and elbow_right[1] <= 1.:
+                arms_draw.line(
+                    [wrist_left, elbow_left, shoulder_left, shoulder_right], 'white', 30, 'curve')
+            else:
+                arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right], 'white', 30,
+                               'curve')
+        elif wrist_left[0] <= 1. and wrist_left[1] <= 1.:
+            if elbow_left[0] <= 1. and elbow_left[1] <= 1.:
+                arms_draw.line([shoulder_left, shoulder_right,
+                               elbow_right, wrist_right], 'white', 30, 'curve')
+            else:
+                arms_draw.line([elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white', 30,
+                               'curve')
+        else:
+            arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white',
+                           30, 'curve')
+
+        if height > 512:
+            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
+                (10, 10), np.uint16), iterations=5)
+        elif height > 256:
+            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
+                (5, 5), np.uint16), iterations=5)
+        hands = np.logical_and(np.logical_not(im_arms), arms)
+        parse_mask += im_arms
+        parser_mask_fixed += hands
+
+    # delete neck
+    parse_head_2 = torch.clone(parse_head)
+    if category == 'dresses' or category == 'upper_body':
+        points = []
+        points.append(np.multiply(pose_data[2, :2], height / 512.0))
+        points.append(np.multiply(pose_data[5, :2], height / 512.0))
+        x_coords, y_coords = zip(*points)
+        A = np.vstack([x_coords, np.ones(len(x_coords))]).T
+        m, c = lstsq(A, y_coords, rcond=None)[0]
+        for i in range(parse_array.shape[1]):
+            y = i * m + c
+            parse_head_2[int(y - 20 * (height / 512.0)):, i] = 0
+
+    parser_mask_fixed = np.logical_or(
+        parser_mask_fixed, np.array(parse_head_2, dtype=np.uint16))
+    parse_mask += np.logical_or(parse_mask, np.logical_and(np.array(parse_head, dtype=np.uint16),
+                                                           np.logical_not(np.array(parse_head_2, dtype=np.uint16))))
+
+    if height > 512:
+        parse_mask = cv2.dilate(parse_mask, np.ones(
+            (20, 20), np.uint16), iterations=5)
+    elif height > 256:
+        parse_mask = cv2.dilate(parse_mask, np.ones(
+            (10, 10), np.uint16), iterations=5)
+    else:
+        parse_mask = cv2.dilate(parse_mask, np.ones(
+            (5, 5), np.uint16), iterations=5)
+    parse_mask = np.logical_and(
+        parser_mask_changeable, np.logical_not(parse_mask))
+    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
+    inpaint_mask = 1 - parse_mask_total
+    img = np.where(inpaint_mask, 255, 0)
+    img = hole_fill(img.astype(np.uint8))
+    inpaint_mask = img / 255 * 1
+    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+
+
+def random_parse(width, height, rng, cells=16):
+    # blobs of random labels, so every mask has edges to erode and dilate
+    coarse = rng.integers(0, 19, size=(cells, cells * width // height + 1), dtype=np.uint8)
+    parse = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_NEAREST)
+    return Image.fromarray(parse)
+
+
+def random_keypoints(rng, missing=(), shoulders_y=None):
+    # OpenPose keypoints of a 384x512 image, the masks scale them by height / 512
+    pose = np.stack([rng.uniform(40, 344, 18), rng.uniform(60, 460, 18)], axis=1)
+    for joint in missing:
+        pose[joint] = 0
+    if shoulders_y is not None:
+        pose[2, 1], pose[5, 1] = shoulders_y
+    return {"pose_keypoints_2d": pose.tolist()}
+
+
+# no joint missing, then each wrist, each wrist with its elbow, and both wrists
+MISSING_JOINTS = [(), (4,), (7,), (3, 4), (6, 7), (4, 7)]
+# right and left shoulder rows, the DC neck cut starts 20 rows above their line: far above the
+# image (clipped negative slice start), above it (negative start counting from the bottom),
+# inside, sloped across the top edge, and below the image
+SHOULDERS_Y = [(-900, -850), (-200, -150), (250, 230), (-40, 80), (600, 700)]
+
+
+def check(name, expected, actual):
+    expected = np.array(expected)
+    actual = np.array(actual)
+    assert expected.shape == actual.shape, "{}: {} != {}".format(name, expected.shape, actual.shape)
+    mismatched = int((expected != actual).sum())
+    assert mismatched == 0, "{}: {} pixels differ".format(name, mismatched)
+
+
+def check_masks(rng, runs):
+    checked = 0
+    for width, height in SIZES:
+        for category in CATEGORIES:
+            for missing in MISSING_JOINTS:
+                for _ in range(runs):
+                    keypoint = random_keypoints(rng, missing)
+                    name = "{} {}x{} missing {}".format(category, width, height, list(missing))
+                    # the HD mask resizes the parse map to size, the DC mask expects it at size
+                    model_parse = random_parse(384, 512, rng)
+                    for model_type in ("hd", "dc"):
+                        check("hd/{} {}".format(model_type, name),
+                              reference_get_agnostic_mask_hd(model_parse, keypoint, category, (width, height),
+                                                             model_type),
+                              get_agnostic_mask_hd(model_parse, keypoint, category, (width, height), model_type))
+                    model_parse = random_parse(width, height, rng)
+                    check("dc " + name,
+                          reference_get_agnostic_mask_dc(model_parse, keypoint, category, (width, height)),
+                          get_agnostic_mask_dc(model_parse, keypoint, category, (width, height)))
+                    checked += 1
+        for category in ["upper_body", "dresses"]:
+            for shoulders_y in SHOULDERS_Y:
+                for _ in range(runs):
+                    keypoint = random_keypoints(rng, shoulders_y=shoulders_y)
+                    model_parse = random_parse(width, height, rng)
+                    check("dc {} {}x{} shoulders at {}".format(category, width, height, shoulders_y),
+                          reference_get_agnostic_mask_dc(model_parse, keypoint, category, (width, height)),
+                          get_agnostic_mask_dc(model_parse, keypoint, category, (width, height)))
+                    checked += 1
+    return checked
+
+
+def reference_neck_cut(shape, shoulder_right, shoulder_left, offset):
+    # the per column loop below_shoulder_line replaced, on the torch mask it used to cut
+    mask = torch.ones(shape)
+    x_coords, y_coords = zip(shoulder_right, shoulder_left)
+    A = np.vstack([x_coords, np.ones(len(x_coords))]).T
+    m, c = lstsq(A, y_coords, rcond=None)[0]
+    for i in range(shape[1]):
+        y = i * m + c
+        mask[int(y - offset):, i] = 0
+    return np.array(mask) == 0
+
+
+def check_morphology(rng, runs):
+    for _ in range(runs):
+        for shoulders_y in SHOULDERS_Y:
+            for width, height in SIZES:
+                shoulder_right = (rng.uniform(0, width), shoulders_y[0] * height / 512.0)
+                shoulder_left = (rng.uniform(0, width), shoulders_y[1] * height / 512.0)
+                offset = 20 * (height / 512.0)
+                check("neck cut {}x{} shoulders at {}".format(width, height, shoulders_y),
+                      reference_neck_cut((height, width), shoulder_right, shoulder_left, offset),
+                      below_shoulder_line((height, width), shoulder_right, shoulder_left, offset))
+        # iterated passes of the original uint16 kernels on float masks, as the masks used to run
+        mask = np.array(random_parse(384, 512, rng)) == 4
+        for ksize, iterations in ((5, 1), (5, 4), (5, 5), (10, 5), (20, 5)):
+            kernel = np.ones((ksize, ksize), np.uint16)
+            check("dilate {}x{} x{}".format(ksize, ksize, iterations),
+                  cv2.dilate(mask.astype(np.float32), kernel, iterations=iterations) > 0,
+                  dilate_mask(mask, ksize, iterations))
+            check("erode {}x{} x{}".format(ksize, ksize, iterations),
+                  cv2.erode(mask.astype(np.float32), kernel, iterations=iterations) > 0,
+                  erode_mask(mask, ksize, iterations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=2, help="random parse maps per size, category and pose")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    check_morphology(rng, args.runs)
+    checked = check_masks(rng, args.runs)
+    logger.info("{} parse maps: the HD and DC masks match the original implementation".format(checked))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,4 @@
-import glob
 import os
-import shutil
-import time
-from random import randint
 
 import cv2
 import numpy as np
@@ -16,6 +12,8 @@ from detectron2.data.detection_utils import read_image
 from detectron2.engine.defaults import DefaultPredictor
 from PIL import Image
 
+from leffa_utils.densepose_predictor import set_labels_only
+
 
 class DensePose:
     """
@@ -28,7 +26,11 @@ class DensePose:
     Noted that the config file should match the model checkpoint and Base-DensePose-RCNN-FPN.yaml is also needed.
     """
 
-    def __init__(self, model_path="./checkpoints/densepose_", device="cuda"):
+    def __init__(self, model_path="./checkpoints/densepose_", device="cuda", densepose_predictor=None):
+        """
+        :param densepose_predictor: a DensePosePredictor of the same checkpoint to share its model and
+            memoized forwards with, instead of loading another copy of the weights.
+        """
         self.device = device
         self.config_path = os.path.join(model_path, "densepose_rcnn_R_50_FPN_s1x.yaml")
         self.model_path = os.path.join(model_path, "model_final_162be9.pkl")
@@ -37,11 +39,28 @@ class DensePose:
         self.min_score = 0.8
 
         self.cfg = self.setup_config()
-        self.predictor = DefaultPredictor(self.cfg)
-        self.predictor.model.to(self.device)
+        self.densepose_predictor = densepose_predictor
+        if densepose_predictor is None:
+            self.predictor = DefaultPredictor(self.cfg)
+            self.predictor.model.to(self.device)
+            # only the part labels are used
+            set_labels_only(self.predictor.model, True)
+        self.context = self.create_context(self.cfg, None)
+
+    def predict_instances(self, img):
+        if self.densepose_predictor is None:
+            return self.predictor(img)["instances"]
+        # the shared model keeps boxes from a lower score threshold, NMS never lets a box below
+        # min_score suppress one above it, so filtering afterwards gives the same instances
+        instances = self.densepose_predictor.predict_instances(img, with_uv=False)
+        return instances[instances.scores >= self.min_score]
 
     def setup_config(self):
-        opts = ["MODEL.ROI_HEADS.SCORE_THRESH_TEST", str(self.min_score)]
+        opts = [
+            "MODEL.ROI_HEADS.SCORE_THRESH_TEST", str(self.min_score),
+            # only the top scoring person is used
+            "TEST.DETECTIONS_PER_IMAGE", "1",
+        ]
         cfg = get_cfg()
         add_densepose_config(cfg)
         cfg.merge_from_file(self.config_path)
@@ -50,20 +69,6 @@ class DensePose:
         cfg.freeze()
         return cfg
 
-    @staticmethod
-    def _get_input_file_list(input_spec: str):
-        if os.path.isdir(input_spec):
-            file_list = [
-                os.path.join(input_spec, fname)
-                for fname in os.listdir(input_spec)
-                if os.path.isfile(os.path.join(input_spec, fname))
-            ]
-        elif os.path.isfile(input_spec):
-            file_list = [input_spec]
-        else:
-            file_list = glob.glob(input_spec)
-        return file_list
-
     def create_context(self, cfg, output_path):
         vis_specs = self.visualizations
         visualizers = []
@@ -101,67 +106,47 @@ class DensePose:
         x, y, w, h = [int(_) for _ in box[0].cpu().numpy()]
         i_array = data[0].labels[None].cpu().numpy()[0]
         result[y : y + h, x : x + w] = i_array
-        result = Image.fromarray(result)
-        result.save(context["out_fname"])
+        return result
 
     def __call__(self, image_or_path, resize=512) -> Image.Image:
         """
-        :param image_or_path: Path of the input image.
+        :param image_or_path: Path of the input image, PIL image or RGB numpy array.
         :param resize: Resize the input image if its max size is larger than this value.
         :return: Dense pose image.
         """
-        # random tmp path with timestamp
-        tmp_path = f"./densepose_/tmp/"
-        if not os.path.exists(tmp_path):
-            os.makedirs(tmp_path)
-
-        image_path = os.path.join(
-            tmp_path, f"{int(time.time())}-{self.device}-{randint(0, 100000)}.png"
-        )
         if isinstance(image_or_path, str):
             assert image_or_path.split(".")[-1] in [
                 "jpg",
                 "png",
             ], "Only support jpg and png images."
-            shutil.copy(image_or_path, image_path)
+            w, h = Image.open(image_or_path).size
+            img = read_image(image_or_path, format="BGR")  # predictor expects BGR image.
         elif isinstance(image_or_path, Image.Image):
-            image_or_path.save(image_path)
+            w, h = image_or_path.size
+            img = np.asarray(image_or_path.convert("RGB"))[:, :, ::-1]
+        elif isinstance(image_or_path, np.ndarray):
+            h, w = image_or_path.shape[:2]
+            img = image_or_path[:, :, ::-1]
         else:
-            shutil.rmtree(tmp_path)
-            raise TypeError("image_path must be str or PIL.Image.Image")
-
-        output_path = image_path.replace(".png", "_dense.png").replace(
-            ".jpg", "_dense.png"
-        )
-        w, h = Image.open(image_path).size
-
-        file_list = self._get_input_file_list(image_path)
-        assert len(file_list), "No input images found!"
-        context = self.create_context(self.cfg, output_path)
-        for file_name in file_list:
-            img = read_image(file_name, format="BGR")  # predictor expects BGR image.
-            # resize
-            if (_ := max(img.shape)) > resize:
-                scale = resize / _
-                img = cv2.resize(
-                    img, (int(img.shape[1] * scale), int(img.shape[0] * scale))
-                )
-
-            with torch.no_grad():
-                outputs = self.predictor(img)["instances"]
-                try:
-                    self.execute_on_outputs(
-                        context, {"file_name": file_name, "image": img}, outputs
-                    )
-                except Exception as e:
-                    null_gray = Image.new("L", (1, 1))
-                    null_gray.save(output_path)
-
-        dense_gray = Image.open(output_path).convert("L")
+            raise TypeError("image_or_path must be str, PIL.Image.Image or np.ndarray")
+        img = np.ascontiguousarray(img)
+
+        # resize
+        if (_ := max(img.shape)) > resize:
+            scale = resize / _
+            img = cv2.resize(
+                img, (int(img.shape[1] * scale), int(img.shape[0] * scale))
+            )
+
+        with torch.no_grad():
+            outputs = self.predict_instances(img)
+            try:
+                result = self.execute_on_outputs(self.context, {"image": img}, outputs)
+            except Exception as e:
+                result = np.zeros((1, 1), dtype=np.uint8)
+
+        dense_gray = Image.fromarray(result)
         dense_gray = dense_gray.resize((w, h), Image.NEAREST)
-        # remove image_path and output_path
-        os.remove(image_path)
-        os.remove(output_path)
 
         return dense_gray
 
@@ -1,19 +1,178 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 from densepose import add_densepose_config
+from densepose.modeling.predictors import DensePoseChartPredictor
+from densepose.structures import (
+    DensePoseChartPredictorOutput,
+    DensePoseDataRelative,
+    decorate_predictor_output_class_with_confidences,
+)
 from densepose.vis.densepose_results import (
     DensePoseResultsFineSegmentationVisualizer as Visualizer,
 )
 from densepose.vis.extractor import DensePoseResultExtractor
 from detectron2.config import get_cfg
+from detectron2.data import transforms as T
 from detectron2.engine import DefaultPredictor
+from detectron2.modeling import detector_postprocess
+from detectron2.structures import Boxes, Instances
+
+# what the chart predictor returns, the extractor reads its (absent) confidences
+TracedPredictorOutput = decorate_predictor_output_class_with_confidences(DensePoseChartPredictorOutput)
+
+
+def fine_segmentation_lut(cmap=cv2.COLORMAP_PARULA):
+    """
+    RGB color of each part label, as drawn by DensePoseResultsFineSegmentationVisualizer:
+    labels scaled by 255 / 24 and truncated to uint8, colormapped, background black.
+    """
+    val_scale = 255.0 / DensePoseDataRelative.N_PART_LABELS
+    labels = np.arange(DensePoseDataRelative.N_PART_LABELS + 1, dtype=np.float32)
+    lut = cv2.applyColorMap((labels * val_scale).astype(np.uint8)[:, None], cmap)[:, 0, ::-1].copy()
+    lut[0] = 0
+    return torch.from_numpy(lut)
+
+
+def set_labels_only(model, labels_only):
+    """Makes the DensePose chart heads of the model skip U and V."""
+    for module in model.modules():
+        if isinstance(module, DensePoseChartPredictor):
+            module.labels_only = labels_only
+
+
+def image_key(image):
+    if isinstance(image, str):
+        return image
+    image = np.ascontiguousarray(image)
+    return image.shape, image.dtype.str, hashlib.blake2b(image.data, digest_size=16).digest()
+
+
+class TracedDensePoseModel(object):
+    """
+    Runs a DensePose model traced by export_densepose.py, in place of DefaultPredictor.
+    Neither the config nor the model code is needed, the resize settings come with the artifact.
+    The trace bakes in the device it was exported on, the model is loaded there.
+    """
+
+    def __init__(self, traced_path, device=None, min_size_test=None):
+        extra_files = {"config.json": ""}
+        # no map_location, the tensors stay on the export device
+        self.model = torch.jit.load(traced_path, _extra_files=extra_files)
+        self.config = json.loads(extra_files["config.json"])
+        self.device = torch.device(self.config["device"])
+        if device is not None and torch.device(device) != self.device:
+            raise ValueError("{} was exported on {}, export it again on {} to run it there".format(
+                traced_path, self.device, torch.device(device)))
+        min_size_test = min_size_test or self.config["min_size_test"]
+        self.aug = T.ResizeShortestEdge([min_size_test, min_size_test], self.config["max_size_test"])
+        self.input_format = self.config["input_format"]
+
+    def __call__(self, original_image):
+        """Same as DefaultPredictor, takes a BGR image and returns {"instances": Instances}."""
+        with torch.no_grad():
+            if self.input_format == "RGB":
+                original_image = original_image[:, :, ::-1]
+            height, width = original_image.shape[:2]
+            image = self.aug.get_transform(original_image).apply_image(original_image)
+            image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1)).to(self.device)
+
+            outputs = dict(zip(self.config["output_names"], self.model(image)))
+            instances = Instances(
+                tuple(image.shape[1:]),
+                pred_boxes=Boxes(outputs["pred_boxes"]),
+                scores=outputs["scores"],
+                pred_classes=outputs["pred_classes"],
+            )
+            instances.pred_densepose = TracedPredictorOutput(
+                coarse_segm=outputs["coarse_segm"],
+                fine_segm=outputs["fine_segm"],
+                u=outputs.get("u"),
+                v=outputs.get("v"),
+            )
+            return {"instances": detector_postprocess(instances, height, width)}
+
+
+class BatchPredictor(DefaultPredictor):
+    """
+    DefaultPredictor that also takes a list of images with batch(): each one is resized like
+    DefaultPredictor, then the model pads them into one ImageList and runs the backbone once
+    per batch_size images. Calling it still predicts a single image.
+    """
+
+    def __init__(self, cfg, batch_size=8):
+        super().__init__(cfg)
+        self.batch_size = batch_size
+
+    def batch(self, original_images):
+        """
+        Args:
+            original_images (list[np.ndarray]): images of shape (H, W, C) (in BGR order),
+                of any sizes.
+
+        Returns:
+            list[dict]: the output of the model for each image, in order.
+        """
+        predictions = []
+        with torch.no_grad():
+            for start in range(0, len(original_images), self.batch_size):
+                inputs = []
+                for original_image in original_images[start:start + self.batch_size]:
+                    if self.input_format == "RGB":
+                        original_image = original_image[:, :, ::-1]
+                    height, width = original_image.shape[:2]
+                    image = self.aug.get_transform(original_image).apply_image(original_image)
+                    image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+                    inputs.append({"image": image, "height": height, "width": width})
+                predictions.extend(self.model(inputs))
+        return predictions
 
 
 class DensePosePredictor(object):
+    """
+    The DensePose service of the project, one loaded model shared by the app, the API server and
+    AutoMasker. The detectron2 forward is memoized per image, so asking for the labels, IUV and
+    segmentation of the same image runs the model once.
+    """
+
     def __init__(self,
                  config_path="./ckpts/densepose/densepose_rcnn_R_50_FPN_s1x.yaml",
-                 weights_path="./ckpts/densepose/model_final_162be9.pkl"
+                 weights_path="./ckpts/densepose/model_final_162be9.pkl",
+                 cache_size=4,
+                 single_person=False,
+                 min_size_test=None,
+                 traced_path=None,
+                 batch_size=8,
                  ):
+        """
+        :param single_person: keep only the top scoring person box, the DensePose head then runs on
+            one ROI. predict_iuv already used only that one.
+        :param min_size_test: shorter side the detector runs at (800 in the config), lower is faster on
+            CPU. Boxes are rescaled to the input image and the results are box relative, so every
+            output stays at the original resolution.
+        :param traced_path: a model exported by export_densepose.py, loaded instead of building it from
+            the config. single_person, labels only and the device are fixed at export time.
+        :param batch_size: images per forward in predict_instances_batch, the traced model runs
+            them one by one.
+        """
+        self.extractor = DensePoseResultExtractor()
+        self.visualizer = Visualizer()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.forward_lock = threading.Lock()
+        if traced_path is not None:
+            self.predictor = TracedDensePoseModel(traced_path, min_size_test=min_size_test)
+            self.device = self.predictor.device
+            self.lut = fine_segmentation_lut().to(self.device)
+            return
+
         cfg = get_cfg()
         add_densepose_config(cfg)
         cfg.merge_from_file(
@@ -21,18 +180,89 @@ class DensePosePredictor(object):
         cfg.MODEL.WEIGHTS = weights_path  # Use the path to the pre-trained model weights
         cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
         cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # Adjust as needed
-        self.predictor = DefaultPredictor(cfg)
-        self.extractor = DensePoseResultExtractor()
-        self.visualizer = Visualizer()
+        if single_person:
+            # boxes are sorted by score after NMS, the ROI heads keep the first one only
+            cfg.TEST.DETECTIONS_PER_IMAGE = 1
+        if min_size_test is not None:
+            cfg.INPUT.MIN_SIZE_TEST = min_size_test
+        self.predictor = BatchPredictor(cfg, batch_size)
+        self.device = torch.device(cfg.MODEL.DEVICE)
+        self.lut = fine_segmentation_lut().to(self.device)
 
-    def predict(self, image):
+    def predict_instances(self, image, with_uv=True):
+        """
+        Detectron2 instances of the image, memoized over the last cache_size images.
+        with_uv=False skips the U and V heads, a memoized forward with UV is reused either way.
+        """
+        key = image_key(image)
+        with self.cache_lock:
+            if key in self.cache and (self.cache[key][1] or not with_uv):
+                self.cache.move_to_end(key)
+                return self.cache[key][0]
         if isinstance(image, str):
             image = cv2.imread(image)
-        with torch.no_grad():
-            outputs = self.predictor(image)["instances"]
+        # the heads are shared, the mode is set and used under the lock
+        with self.forward_lock, torch.no_grad():
+            set_labels_only(self.predictor.model, not with_uv)
+            instances = self.predictor(image)["instances"]
+        with self.cache_lock:
+            self.cache[key] = (instances, with_uv)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return instances
+
+    def predict_instances_batch(self, images, with_uv=True):
+        """
+        predict_instances of several images, the ones not memoized share batched forwards.
+        Batch jobs raise cache_size to the batch size so the per-image predict_* methods reuse them.
+        """
+        keys = [image_key(image) for image in images]
+        images = [cv2.imread(image) if isinstance(image, str) else image for image in images]
+        instances = [None] * len(images)
+        with self.cache_lock:
+            for i, key in enumerate(keys):
+                if key in self.cache and (self.cache[key][1] or not with_uv):
+                    self.cache.move_to_end(key)
+                    instances[i] = self.cache[key][0]
+        missing = [i for i, result in enumerate(instances) if result is None]
+        if missing:
+            with self.forward_lock, torch.no_grad():
+                set_labels_only(self.predictor.model, not with_uv)
+                if isinstance(self.predictor, BatchPredictor):
+                    predictions = self.predictor.batch([images[i] for i in missing])
+                else:
+                    predictions = [self.predictor(images[i]) for i in missing]
+            with self.cache_lock:
+                for i, prediction in zip(missing, predictions):
+                    instances[i] = prediction["instances"]
+                    self.cache[keys[i]] = (instances[i], with_uv)
+                    self.cache.move_to_end(keys[i])
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return instances
+
+    def predict(self, image, with_uv=True):
+        outputs = self.predict_instances(image, with_uv)
         outputs = self.extractor(outputs)
         return outputs
 
+    def predict_all(self, image):
+        """
+        Labels, IUV, bbox and colorized segmentation of the image from a single forward.
+        labels: (H, W) uint8, iuv: predict_iuv, bbox: [x, y, w, h] of the first person or None,
+        segmentation: predict_fine_segmentation.
+        """
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        results, boxes_xywh = self.predict(image)
+        return {
+            "labels": self.predict_fine_segmentation(image, colorize=False)[:, :, 0],
+            "iuv": self.predict_iuv(image) if results else None,
+            "bbox": [int(v) for v in boxes_xywh[0].tolist()] if results else None,
+            "segmentation": self.predict_fine_segmentation(image),
+        }
+
     def predict_iuv(self, image):
         outputs = self.predict(image)
 
@@ -62,6 +292,33 @@ class DensePosePredictor(object):
 
         return image_seg
 
+    def predict_fine_segmentation(self, image, colorize=True, output_size=None):
+        """
+        Fine part segmentation of the image, computed on the model device.
+        colorize=True gives the predict_seg colors in RGB, colorize=False the part labels of
+        predict_iuv channel 0 repeated 3 times. Same instance as each of them: predict_seg only
+        keeps the last person drawn, predict_iuv the first.
+        output_size: (width, height), the image size by default.
+        Returns a contiguous (height, width, 3) uint8 RGB array.
+        """
+        results, boxes_xywh = self.predict(image, with_uv=False)
+        H, W = image.shape[:2]
+        labels = torch.zeros((H, W), dtype=torch.uint8, device=self.device)
+        if results:
+            index = len(results) - 1 if colorize else 0
+            x, y, w, h = [int(v) for v in boxes_xywh[index].tolist()]
+            region = labels[y:y + h, x:x + w]
+            region.copy_(results[index].labels[:region.shape[0], :region.shape[1]])
+
+        if output_size is not None and tuple(output_size) != (W, H):
+            labels = F.interpolate(labels[None, None].float(), size=(output_size[1], output_size[0]),
+                                   mode="nearest")[0, 0].to(torch.uint8)
+        if colorize:
+            seg = self.lut[labels.long()]
+        else:
+            seg = labels[..., None].expand(-1, -1, 3)
+        return seg.contiguous().cpu().numpy()
+
 
 if __name__ == "__main__":
     import sys
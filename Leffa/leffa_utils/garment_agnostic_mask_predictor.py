@@ -115,6 +115,16 @@ MASK_DENSE_PARTS = {
     "inner": ["torso"],
     "outer": ["torso", "big arms", "forearms"],
 }
+ACCESSORY_PARTS = [
+    "Hat",
+    "Glove",
+    "Sunglasses",
+    "Bag",
+    "Left-shoe",
+    "Right-shoe",
+    "Scarf",
+    "Socks",
+]
 
 schp_public_protect_parts = [
     "Hat",
@@ -171,19 +181,82 @@ def vis_mask(image, mask):
     return Image.fromarray((image * (1 - mask)).astype(np.uint8))
 
 
-def part_mask_of(part: Union[str, list], parse: np.ndarray, mapping: dict):
+def part_lut(part: Union[str, list], mapping: dict):
+    """uint8 table of part_mask_of: how many of the listed parts each label belongs to."""
     if isinstance(part, str):
         part = [part]
-    mask = np.zeros_like(parse)
+    lut = np.zeros(256, dtype=np.uint8)
     for _ in part:
         if _ not in mapping:
             continue
         if isinstance(mapping[_], list):
             for i in mapping[_]:
-                mask += parse == i
+                lut[i] += 1
         else:
-            mask += parse == mapping[_]
-    return mask
+            lut[mapping[_]] += 1
+    return lut
+
+
+def part_mask_of(part: Union[str, list], parse: np.ndarray, mapping: dict):
+    return part_lut(part, mapping)[parse]
+
+
+def part_bits_lut(parts: list, mapping: dict):
+    """uint8 table with bit k set on the labels of parts[k], up to 8 part masks from one lookup."""
+    assert len(parts) <= 8
+    lut = np.zeros(256, dtype=np.uint8)
+    for k, part in enumerate(parts):
+        mask_lut = part_lut(part, mapping)
+        # a label listed twice would count 2 in part_mask_of
+        assert mask_lut.max() <= 1, part
+        lut |= mask_lut << k
+    return lut
+
+
+def part_masks_of(parts: dict, parse: np.ndarray, lut: np.ndarray):
+    """The part_mask_of masks of the parts that built lut with part_bits_lut, in the same order."""
+    bits = lut[parse]
+    return {name: (bits >> k) & 1 for k, name in enumerate(parts)}
+
+
+def cloth_agnostic_parts(part: str):
+    """The part lists AutoMasker.cloth_agnostic_mask reads from each map."""
+    return {
+        "densepose": {
+            "hands": ["hands", "feet"],
+            "mask": MASK_DENSE_PARTS[part],
+        },
+        "lip": {
+            "limbs": ["Left-arm", "Right-arm", "Left-leg", "Right-leg"],
+            "face": ["Face"],
+            "body": PROTECT_BODY_PARTS[part],
+            "hair": ["Hair"],
+            "cloth": PROTECT_CLOTH_PARTS[part]["LIP"],
+            "accessory": ACCESSORY_PARTS,
+            "mask": MASK_CLOTH_PARTS[part],
+            "background": ["Background"],
+        },
+        "atr": {
+            "limbs": ["Left-arm", "Right-arm", "Left-leg", "Right-leg"],
+            "body": PROTECT_BODY_PARTS[part],
+            "hair": ["Hair"],
+            "cloth": PROTECT_CLOTH_PARTS[part]["ATR"],
+            "accessory": ACCESSORY_PARTS,
+            "mask": MASK_CLOTH_PARTS[part],
+            "background": ["Background"],
+        },
+    }
+
+
+MAPPINGS = {"densepose": DENSE_INDEX_MAP, "lip": LIP_MAPPING, "atr": ATR_MAPPING}
+# per part, the parts read from each map and their bits table
+CLOTH_AGNOSTIC_LUTS = {
+    part: {
+        source: (parts, part_bits_lut(list(parts.values()), MAPPINGS[source]))
+        for source, parts in cloth_agnostic_parts(part).items()
+    }
+    for part in MASK_DENSE_PARTS
+}
 
 
 def hull_mask(mask_area: np.ndarray):
@@ -191,10 +264,10 @@ def hull_mask(mask_area: np.ndarray):
     contours, hierarchy = cv2.findContours(
         binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
     )
+    # one fillPoly per hull, together they would xor where the hulls overlap
     hull_mask = np.zeros_like(mask_area)
     for c in contours:
-        hull = cv2.convexHull(c)
-        hull_mask = cv2.fillPoly(np.zeros_like(mask_area), [hull], 255) | hull_mask
+        cv2.fillPoly(hull_mask, [cv2.convexHull(c)], 255)
     return hull_mask
 
 
@@ -204,12 +277,13 @@ class AutoMasker:
         densepose_path: str = "./ckpts/densepose",
         schp_path: str = "./ckpts/schp",
         device="cuda",
+        densepose_predictor=None,
     ):
         np.random.seed(0)
         torch.manual_seed(0)
         torch.cuda.manual_seed(0)
 
-        self.densepose_processor = DensePose(densepose_path, device)
+        self.densepose_processor = DensePose(densepose_path, device, densepose_predictor)
         # Temporarily commented out SCHP for testing
         # self.schp_processor_atr = SCHP(
         #     ckpt_path=os.path.join(schp_path, "exp-schp-201908301523-atr.pth"),
@@ -291,53 +365,23 @@ class AutoMasker:
         schp_lip_mask = np.array(schp_lip_mask)
         schp_atr_mask = np.array(schp_atr_mask)
 
+        # each map is looked up once for all its part masks
+        dense = part_masks_of(*CLOTH_AGNOSTIC_LUTS[part]["densepose"], densepose_mask)
+        lip = part_masks_of(*CLOTH_AGNOSTIC_LUTS[part]["lip"], schp_lip_mask)
+        atr = part_masks_of(*CLOTH_AGNOSTIC_LUTS[part]["atr"], schp_atr_mask)
+
         # Strong Protect Area (Hands, Face, Accessory, Feet)
-        hands_protect_area = part_mask_of(
-            ["hands", "feet"], densepose_mask, DENSE_INDEX_MAP
-        )
-        hands_protect_area = cv2.dilate(hands_protect_area, dilate_kernel, iterations=1)
-        hands_protect_area = hands_protect_area & (
-            part_mask_of(
-                ["Left-arm", "Right-arm", "Left-leg", "Right-leg"],
-                schp_atr_mask,
-                ATR_MAPPING,
-            )
-            | part_mask_of(
-                ["Left-arm", "Right-arm", "Left-leg", "Right-leg"],
-                schp_lip_mask,
-                LIP_MAPPING,
-            )
-        )
-        face_protect_area = part_mask_of("Face", schp_lip_mask, LIP_MAPPING)
+        hands_protect_area = cv2.dilate(dense["hands"], dilate_kernel, iterations=1)
+        hands_protect_area = hands_protect_area & (atr["limbs"] | lip["limbs"])
+        face_protect_area = lip["face"]
 
         strong_protect_area = hands_protect_area | face_protect_area
 
         # Weak Protect Area (Hair, Irrelevant Clothes, Body Parts)
-        body_protect_area = part_mask_of(
-            PROTECT_BODY_PARTS[part], schp_lip_mask, LIP_MAPPING
-        ) | part_mask_of(PROTECT_BODY_PARTS[part], schp_atr_mask, ATR_MAPPING)
-        hair_protect_area = part_mask_of(
-            ["Hair"], schp_lip_mask, LIP_MAPPING
-        ) | part_mask_of(["Hair"], schp_atr_mask, ATR_MAPPING)
-        cloth_protect_area = part_mask_of(
-            PROTECT_CLOTH_PARTS[part]["LIP"], schp_lip_mask, LIP_MAPPING
-        ) | part_mask_of(PROTECT_CLOTH_PARTS[part]["ATR"], schp_atr_mask, ATR_MAPPING)
-        accessory_protect_area = part_mask_of(
-            (
-                accessory_parts := [
-                    "Hat",
-                    "Glove",
-                    "Sunglasses",
-                    "Bag",
-                    "Left-shoe",
-                    "Right-shoe",
-                    "Scarf",
-                    "Socks",
-                ]
-            ),
-            schp_lip_mask,
-            LIP_MAPPING,
-        ) | part_mask_of(accessory_parts, schp_atr_mask, ATR_MAPPING)
+        body_protect_area = lip["body"] | atr["body"]
+        hair_protect_area = lip["hair"] | atr["hair"]
+        cloth_protect_area = lip["cloth"] | atr["cloth"]
+        accessory_protect_area = lip["accessory"] | atr["accessory"]
         weak_protect_area = (
             body_protect_area
             | cloth_protect_area
@@ -347,15 +391,9 @@ class AutoMasker:
         )
 
         # Mask Area
-        strong_mask_area = part_mask_of(
-            MASK_CLOTH_PARTS[part], schp_lip_mask, LIP_MAPPING
-        ) | part_mask_of(MASK_CLOTH_PARTS[part], schp_atr_mask, ATR_MAPPING)
-        background_area = part_mask_of(
-            ["Background"], schp_lip_mask, LIP_MAPPING
-        ) & part_mask_of(["Background"], schp_atr_mask, ATR_MAPPING)
-        mask_dense_area = part_mask_of(
-            MASK_DENSE_PARTS[part], densepose_mask, DENSE_INDEX_MAP
-        )
+        strong_mask_area = lip["mask"] | atr["mask"]
+        background_area = lip["background"] & atr["background"]
+        mask_dense_area = dense["mask"]
         mask_dense_area = cv2.resize(
             mask_dense_area.astype(np.uint8),
             None,
@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# per library thread counts, e.g. the ones printed by the benchmark below
+THREAD_ENV_VARS = {
+    "ort_threads": "LEFFA_ORT_THREADS",
+    "torch_threads": "LEFFA_TORCH_THREADS",
+    "opencv_threads": "LEFFA_OPENCV_THREADS",
+}
+
+
+def env_threads(name):
+    value = os.environ.get(THREAD_ENV_VARS[name])
+    return int(value) if value else None
+
+
+class ThreadBudget(object):
+    """
+    Splits the CPU cores of the machine between concurrent workers, and the
+    cores of one worker between its ORT, torch and OpenCV pools.
+
+    A worker runs its stages one after the other, except human parsing whose
+    ATR and LIP sessions run concurrently, so each session gets half of the
+    ORT share. Torch (OpenPose, DensePose, the UNets) and OpenCV get the whole
+    worker share since they never overlap with each other.
+
+    A count that is not given is read from its LEFFA_*_THREADS environment
+    variable, so the split found by the benchmark can be applied without
+    changing the app or the API server.
+    """
+
+    def __init__(self, num_threads=None, num_workers=1, ort_threads=None, torch_threads=None, opencv_threads=None):
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.num_workers = max(1, num_workers)
+        self.worker_threads = max(1, self.num_threads // self.num_workers)
+        # per parsing session
+        self.ort_threads = ort_threads or env_threads("ort_threads") or max(1, self.worker_threads // 2)
+        self.torch_threads = torch_threads or env_threads("torch_threads") or self.worker_threads
+        self.opencv_threads = opencv_threads or env_threads("opencv_threads") or self.worker_threads
+
+    def __repr__(self):
+        return "ThreadBudget(num_threads={}, num_workers={}, ort_threads={}, torch_threads={}, opencv_threads={})".format(
+            self.num_threads, self.num_workers, self.ort_threads, self.torch_threads, self.opencv_threads)
+
+    def ort_session_options(self):
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = self.ort_threads
+        # inter-op threads are only used by ORT_PARALLEL
+        session_options.inter_op_num_threads = 1
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if self.num_workers > 1:
+            # spinning threads steal cores from the other workers
+            session_options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        return session_options
+
+    def env(self):
+        """The environment variables that reproduce this split."""
+        return {env_var: str(getattr(self, name)) for name, env_var in THREAD_ENV_VARS.items()}
+
+    def apply(self):
+        """Applies the torch and OpenCV pools process-wide."""
+        import cv2
+        import torch
+
+        torch.set_num_threads(self.torch_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work
+            pass
+        cv2.setNumThreads(self.opencv_threads)
+        logger.info("Applied {}".format(self))
+        return self
+
+
+def candidate_budgets(num_threads=None, num_workers=1):
+    """Yields the ORT/torch splits worth benchmarking for one worker."""
+    default = ThreadBudget(num_threads, num_workers)
+    worker_threads = default.worker_threads
+    sizes = sorted({max(1, worker_threads // d) for d in (1, 2, 4)})
+    ort_sizes = sorted({max(1, s // 2) for s in sizes} | {worker_threads})
+    for ort_threads, torch_threads in itertools.product(ort_sizes, sizes):
+        yield ThreadBudget(num_threads, num_workers, ort_threads=ort_threads,
+                           torch_threads=torch_threads, opencv_threads=torch_threads)
+
+
+def benchmark_thread_budget(budget, build_fn, run_fn, repeats=3):
+    """
+    Returns the mean wall time of one round of `budget.num_workers`
+    concurrent requests. build_fn(budget) builds the per-process state
+    (e.g. the ORT sessions, whose pools are fixed at creation) and
+    run_fn(state) runs a single request.
+
+    The requests run as threads of this process sharing one state, not as
+    the separate worker processes of WEB_CONCURRENCY, so with more than one
+    worker they also contend for the GIL and the shared torch/OpenCV pools.
+    The timings are an approximation for ranking the splits, not the
+    throughput of the server.
+    """
+    budget.apply()
+    state = build_fn(budget)
+    run_fn(state)  # warm up
+    with ThreadPoolExecutor(max_workers=budget.num_workers) as executor:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            list(executor.map(lambda _: run_fn(state), range(budget.num_workers)))
+        return (time.perf_counter() - start) / repeats
+
+
+def autotune_thread_budget(build_fn, run_fn, num_threads=None, num_workers=1, repeats=3):
+    """Benchmarks the candidate splits of this machine and returns the fastest one, applied."""
+    best_budget, best_time = None, float("inf")
+    for budget in candidate_budgets(num_threads, num_workers):
+        elapsed = benchmark_thread_budget(budget, build_fn, run_fn, repeats)
+        logger.info("{}: {:.3f}s".format(budget, elapsed))
+        if elapsed < best_time:
+            best_budget, best_time = budget, elapsed
+    return best_budget.apply()
+
+
+if __name__ == "__main__":
+    # python leffa_utils/thread_budget.py --image ... from the project root
+    import sys
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+    import argparse
+
+    from PIL import Image
+    from preprocess.humanparsing.run_parsing import Parsing
+    from preprocess.openpose.run_openpose import OpenPose
+
+    parser = argparse.ArgumentParser(description="Find the fastest CPU thread split of the preprocessing stages.")
+    parser.add_argument("--image", required=True, help="person image used for the benchmark")
+    parser.add_argument("--num_workers", type=int, default=1, help="concurrent requests served by this machine")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--ckpts", default="./ckpts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    image = Image.open(args.image).convert("RGB").resize((768, 1024))
+
+    def build(budget):
+        parsing = Parsing(
+            atr_path=os.path.join(args.ckpts, "humanparsing/parsing_atr.onnx"),
+            lip_path=os.path.join(args.ckpts, "humanparsing/parsing_lip.onnx"),
+            thread_budget=budget,
+        )
+        openpose = OpenPose(body_model_path=os.path.join(args.ckpts, "openpose/body_pose_model.pth"))
+        return parsing, openpose
+
+    def run(state):
+        parsing, openpose = state
+        parsing(image.resize((384, 512)))
+        openpose(image.resize((384, 512)))
+
+    best = autotune_thread_budget(build, run, num_workers=args.num_workers, repeats=args.repeats)
+    print(best)
+    # set these for the app or the API server to start with this split
+    for env_var, value in best.env().items():
+        print("export {}={}".format(env_var, value))
@@ -1,6 +1,5 @@
 import os
 import cv2
-import torch
 import numpy as np
 from numpy.linalg import lstsq
 from PIL import Image, ImageDraw
@@ -100,6 +99,114 @@ def refine_mask(mask):
     return refine_mask
 
 
+# bits of the agnostic mask lookup tables
+FIXED, CHANGEABLE, HEAD, CLOTH, LEFT_ARM, RIGHT_ARM, NECK = (1 << i for i in range(7))
+
+AGNOSTIC_MASK_LABELS = {
+    "hd": {
+        "head": ["hat", "sunglasses", "head"],
+        "fixed": ["left_shoe", "right_shoe", "hat", "sunglasses", "bag"],
+        "cloth": {
+            "dresses": ["dress", "upper_clothes", "skirt", "pants"],
+            "upper_body": ["upper_clothes", "dress"],
+            "lower_body": ["pants", "left_leg", "right_leg", "skirt"],
+        },
+    },
+    "dc": {
+        "head": ["hat", "hair", "sunglasses", "head", "neck"],
+        "fixed": ["hair", "left_shoe", "right_shoe", "hat", "sunglasses", "scarf", "bag"],
+        "cloth": {
+            "dresses": ["dress", "left_leg", "right_leg"],
+            "upper_body": ["upper_clothes"],
+            "lower_body": ["pants", "left_leg", "right_leg"],
+        },
+    },
+}
+
+# what the category keeps on top of the fixed labels
+FIXED_BY_CATEGORY = {
+    "dresses": [],
+    "upper_body": ["skirt", "pants"],
+    "lower_body": ["upper_clothes", "left_arm", "right_arm"],
+}
+
+
+def agnostic_mask_lut(mask_type, category):
+    """uint8 table of the mask bits of every parsing label for get_agnostic_mask_<mask_type>."""
+    labels = AGNOSTIC_MASK_LABELS[mask_type]
+    lut = np.zeros(256, dtype=np.uint8)
+    for name in labels["fixed"] + FIXED_BY_CATEGORY[category]:
+        lut[label_map[name]] |= FIXED
+    # the background and every label that is not fixed
+    lut[(lut & FIXED) == 0] |= CHANGEABLE
+    for name in labels["head"]:
+        lut[label_map[name]] |= HEAD
+    for name in labels["cloth"][category]:
+        lut[label_map[name]] |= CLOTH
+    lut[label_map["left_arm"]] |= LEFT_ARM
+    lut[label_map["right_arm"]] |= RIGHT_ARM
+    lut[label_map["neck"]] |= NECK
+    return lut
+
+
+AGNOSTIC_MASK_LUTS = {
+    (mask_type, category): agnostic_mask_lut(mask_type, category)
+    for mask_type in AGNOSTIC_MASK_LABELS for category in FIXED_BY_CATEGORY
+}
+
+
+def agnostic_label_masks(parse_array, category, mask_type="hd"):
+    """
+    Boolean fixed, changeable, head, cloth, left_arm, right_arm and neck masks of a parsing map,
+    from one lookup of its labels in the category table.
+    """
+    if category not in FIXED_BY_CATEGORY:
+        raise NotImplementedError
+    bits = AGNOSTIC_MASK_LUTS[mask_type, category][np.asarray(parse_array, dtype=np.uint8)]
+    return {
+        name: (bits & bit) != 0
+        for name, bit in (("fixed", FIXED), ("changeable", CHANGEABLE), ("head", HEAD), ("cloth", CLOTH),
+                          ("left_arm", LEFT_ARM), ("right_arm", RIGHT_ARM), ("neck", NECK))
+    }
+
+
+def rect_kernel(ksize, iterations=1):
+    """
+    Kernel and anchor of a single pass equal to `iterations` passes of a ksize x ksize box with
+    the default anchor: the offsets add up, so the box grows to (ksize - 1) * iterations + 1 and
+    the anchor to ksize // 2 * iterations, off center for even sizes.
+    """
+    size = (ksize - 1) * iterations + 1
+    anchor = ksize // 2 * iterations
+    return np.ones((size, size), np.uint8), (anchor, anchor)
+
+
+def dilate_mask(mask, ksize, iterations=1):
+    kernel, anchor = rect_kernel(ksize, iterations)
+    return cv2.dilate(mask.view(np.uint8), kernel, anchor=anchor).view(bool)
+
+
+def erode_mask(mask, ksize, iterations=1):
+    kernel, anchor = rect_kernel(ksize, iterations)
+    return cv2.erode(mask.view(np.uint8), kernel, anchor=anchor).view(bool)
+
+
+def below_shoulder_line(shape, shoulder_right, shoulder_left, offset):
+    """
+    Mask of the pixels at or below the line through the shoulders raised by offset, each column
+    starting at the int() truncated row the way a per column parse_head[int(y - offset):, i] = 0
+    does, negative rows counting from the bottom.
+    """
+    height, width = shape
+    x_coords, y_coords = zip(shoulder_right, shoulder_left)
+    A = np.vstack([x_coords, np.ones(len(x_coords))]).T
+    m, c = lstsq(A, y_coords, rcond=None)[0]
+    start = np.trunc(np.arange(width) * m + c - offset)
+    start = np.clip(start, -height, height).astype(np.int64)
+    start = np.where(start < 0, start + height, start)
+    return np.arange(height)[:, None] >= start[None, :]
+
+
 def get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model_type="hd"):
     # model_type = "hd"
     ##############################
@@ -114,52 +221,13 @@ def get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model
     else:
         raise ValueError("model_type must be \'hd\' or \'dc\'!")
 
-    parse_head = (parse_array == 1).astype(np.float32) + \
-                 (parse_array == 3).astype(np.float32) + \
-                 (parse_array == 11).astype(np.float32)
-
-    parser_mask_fixed = (parse_array == label_map["left_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["hat"]).astype(np.float32) + \
-                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
-                        (parse_array == label_map["bag"]).astype(np.float32)
-
-    parser_mask_changeable = (
-        parse_array == label_map["background"]).astype(np.float32)
-
-    arms_left = (parse_array == 14).astype(np.float32)
-    arms_right = (parse_array == 15).astype(np.float32)
-
-    if category == 'dresses':
-        parse_mask = (parse_array == 7).astype(np.float32) + \
-                     (parse_array == 4).astype(np.float32) + \
-                     (parse_array == 5).astype(np.float32) + \
-                     (parse_array == 6).astype(np.float32)
-
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-
-    elif category == 'upper_body':
-        parse_mask = (parse_array == 4).astype(np.float32) + \
-            (parse_array == 7).astype(np.float32)
-        parser_mask_fixed_lower_cloth = (parse_array == label_map["skirt"]).astype(np.float32) + \
-                                        (parse_array == label_map["pants"]).astype(
-                                            np.float32)
-        parser_mask_fixed += parser_mask_fixed_lower_cloth
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-    elif category == 'lower_body':
-        parse_mask = (parse_array == 6).astype(np.float32) + \
-                     (parse_array == 12).astype(np.float32) + \
-                     (parse_array == 13).astype(np.float32) + \
-                     (parse_array == 5).astype(np.float32)
-        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
-                             (parse_array == 14).astype(np.float32) + \
-                             (parse_array == 15).astype(np.float32)
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-    else:
-        raise NotImplementedError
+    masks = agnostic_label_masks(parse_array, category, "hd")
+    parse_head = masks["head"]
+    parser_mask_fixed = masks["fixed"]
+    parser_mask_changeable = masks["changeable"]
+    parse_mask = masks["cloth"]
+    arms_left = masks["left_arm"]
+    arms_right = masks["right_arm"]
 
     # Load pose points
     pose_data = keypoint["pose_keypoints_2d"]
@@ -191,6 +259,7 @@ def get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model
                 np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
             arms_draw_right.arc(size_right, 0, 360,
                                 'white', ARM_LINE_WIDTH // 2)
+            im_arms_right = np.asarray(im_arms_right) > 0
 
         if wrist_left[0] <= 1. and wrist_left[1] <= 1.:
             im_arms_left = arms_left
@@ -199,37 +268,25 @@ def get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model
             arms_draw_left.line(np.concatenate((wrist_left, elbow_left, shoulder_left)).astype(
                 np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
             arms_draw_left.arc(size_left, 0, 360, 'white', ARM_LINE_WIDTH // 2)
+            im_arms_left = np.asarray(im_arms_left) > 0
 
-        hands_left = np.logical_and(np.logical_not(im_arms_left), arms_left)
-        hands_right = np.logical_and(np.logical_not(im_arms_right), arms_right)
-        parser_mask_fixed += hands_left + hands_right
+        hands_left = arms_left & ~im_arms_left
+        hands_right = arms_right & ~im_arms_right
+        parser_mask_fixed = parser_mask_fixed | hands_left | hands_right
 
-    parser_mask_fixed = cv2.erode(parser_mask_fixed, np.ones(
-        (5, 5), np.uint16), iterations=1)
-
-    parser_mask_fixed = np.logical_or(parser_mask_fixed, parse_head)
-    parse_mask = cv2.dilate(parse_mask, np.ones(
-        (10, 10), np.uint16), iterations=5)
+    parser_mask_fixed = erode_mask(parser_mask_fixed, 5) | parse_head
+    parse_mask = dilate_mask(parse_mask, 10, iterations=5)
     if category == 'dresses' or category == 'upper_body':
-        neck_mask = (parse_array == 18).astype(np.float32)
-        neck_mask = cv2.dilate(neck_mask, np.ones(
-            (5, 5), np.uint16), iterations=1)
-        neck_mask = np.logical_and(neck_mask, np.logical_not(parse_head))
-        parse_mask = np.logical_or(parse_mask, neck_mask)
-        arm_mask = cv2.dilate(np.logical_or(im_arms_left, im_arms_right).astype(
-            'float32'), np.ones((5, 5), np.uint16), iterations=4)
-        parse_mask += np.logical_or(parse_mask, arm_mask)
-
-    parse_mask = np.logical_and(
-        parser_mask_changeable, np.logical_not(parse_mask))
-
-    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
-    inpaint_mask = 1 - parse_mask_total
-    img = np.where(inpaint_mask, 255, 0)
-    dst = hole_fill(img.astype(np.uint8))
+        neck_mask = dilate_mask(masks["neck"], 5) & ~parse_head
+        arm_mask = dilate_mask(im_arms_left | im_arms_right, 5, iterations=4)
+        parse_mask = parse_mask | neck_mask | arm_mask
+
+    parse_mask = parser_mask_changeable & ~parse_mask
+    parse_mask_total = parse_mask | parser_mask_fixed
+    img = np.where(parse_mask_total, 0, 255).astype(np.uint8)
+    dst = hole_fill(img)
     dst = refine_mask(dst)
-    inpaint_mask = dst / 255 * 1
-    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+    mask = Image.fromarray(dst)
 
     return mask
 
@@ -240,66 +297,12 @@ def get_agnostic_mask_dc(model_parse, keypoint, category, size=(384, 512)):
     pose_data = np.array(pose_data)
     pose_data = pose_data.reshape((-1, 2))
 
-    parse_shape = (parse_array > 0).astype(np.float32)
-
-    parse_head = (parse_array == 1).astype(np.float32) + \
-        (parse_array == 2).astype(np.float32) + \
-        (parse_array == 3).astype(np.float32) + \
-        (parse_array == 11).astype(np.float32) + \
-        (parse_array == 18).astype(np.float32)
-
-    parser_mask_fixed = (parse_array == label_map["hair"]).astype(np.float32) + \
-                        (parse_array == label_map["left_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["hat"]).astype(np.float32) + \
-                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
-                        (parse_array == label_map["scarf"]).astype(np.float32) + \
-                        (parse_array == label_map["bag"]).astype(np.float32)
-
-    parser_mask_changeable = (
-        parse_array == label_map["background"]).astype(np.float32)
-
-    arms = (parse_array == 14).astype(np.float32) + \
-        (parse_array == 15).astype(np.float32)
-
-    if category == 'dresses':
-        label_cat = 7
-        parse_mask = (parse_array == 7).astype(np.float32) + \
-            (parse_array == 12).astype(np.float32) + \
-            (parse_array == 13).astype(np.float32)
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-
-    elif category == 'upper_body':
-        label_cat = 4
-        parse_mask = (parse_array == 4).astype(np.float32)
-
-        parser_mask_fixed += (parse_array == label_map["skirt"]).astype(np.float32) + \
-            (parse_array == label_map["pants"]).astype(np.float32)
-
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-    elif category == 'lower_body':
-        label_cat = 6
-        parse_mask = (parse_array == 6).astype(np.float32) + \
-            (parse_array == 12).astype(np.float32) + \
-            (parse_array == 13).astype(np.float32)
-
-        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
-            (parse_array == 14).astype(np.float32) + \
-            (parse_array == 15).astype(np.float32)
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-
-    parse_head = torch.from_numpy(parse_head)  # [0,1]
-    parse_mask = torch.from_numpy(parse_mask)  # [0,1]
-    parser_mask_fixed = torch.from_numpy(parser_mask_fixed)
-    parser_mask_changeable = torch.from_numpy(parser_mask_changeable)
-
-    # dilation
-    parse_without_cloth = np.logical_and(
-        parse_shape, np.logical_not(parse_mask))
-    parse_mask = parse_mask.cpu().numpy()
+    masks = agnostic_label_masks(parse_array, category, "dc")
+    parse_head = masks["head"]
+    parser_mask_fixed = masks["fixed"]
+    parser_mask_changeable = masks["changeable"]
+    parse_mask = masks["cloth"]
+    arms = masks["left_arm"] | masks["right_arm"]
 
     width = size[0]
     height = size[1]
@@ -331,53 +334,41 @@ def get_agnostic_mask_dc(model_parse, keypoint, category, size=(384, 512)):
             arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white',
                            30, 'curve')
 
+        im_arms = np.asarray(im_arms) > 0
         if height > 512:
-            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
-                (10, 10), np.uint16), iterations=5)
+            im_arms = dilate_mask(im_arms, 10, iterations=5)
         elif height > 256:
-            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
-                (5, 5), np.uint16), iterations=5)
-        hands = np.logical_and(np.logical_not(im_arms), arms)
-        parse_mask += im_arms
-        parser_mask_fixed += hands
+            im_arms = dilate_mask(im_arms, 5, iterations=5)
+        hands = arms & ~im_arms
+        parse_mask = parse_mask | im_arms
+        parser_mask_fixed = parser_mask_fixed | hands
 
     # delete neck
-    parse_head_2 = torch.clone(parse_head)
+    parse_head_2 = parse_head
     if category == 'dresses' or category == 'upper_body':
-        points = []
-        points.append(np.multiply(pose_data[2, :2], height / 512.0))
-        points.append(np.multiply(pose_data[5, :2], height / 512.0))
-        x_coords, y_coords = zip(*points)
-        A = np.vstack([x_coords, np.ones(len(x_coords))]).T
-        m, c = lstsq(A, y_coords, rcond=None)[0]
-        for i in range(parse_array.shape[1]):
-            y = i * m + c
-            parse_head_2[int(y - 20 * (height / 512.0)):, i] = 0
-
-    parser_mask_fixed = np.logical_or(
-        parser_mask_fixed, np.array(parse_head_2, dtype=np.uint16))
-    parse_mask += np.logical_or(parse_mask, np.logical_and(np.array(parse_head, dtype=np.uint16),
-                                                           np.logical_not(np.array(parse_head_2, dtype=np.uint16))))
+        neck = below_shoulder_line(parse_head.shape,
+                                   np.multiply(pose_data[2, :2], height / 512.0),
+                                   np.multiply(pose_data[5, :2], height / 512.0),
+                                   20 * (height / 512.0))
+        parse_head_2 = parse_head & ~neck
+
+    parser_mask_fixed = parser_mask_fixed | parse_head_2
+    parse_mask = parse_mask | (parse_head & ~parse_head_2)
 
     if height > 512:
-        parse_mask = cv2.dilate(parse_mask, np.ones(
-            (20, 20), np.uint16), iterations=5)
+        parse_mask = dilate_mask(parse_mask, 20, iterations=5)
     elif height > 256:
-        parse_mask = cv2.dilate(parse_mask, np.ones(
-            (10, 10), np.uint16), iterations=5)
+        parse_mask = dilate_mask(parse_mask, 10, iterations=5)
     else:
-        parse_mask = cv2.dilate(parse_mask, np.ones(
-            (5, 5), np.uint16), iterations=5)
-    parse_mask = np.logical_and(
-        parser_mask_changeable, np.logical_not(parse_mask))
-    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
-    inpaint_mask = 1 - parse_mask_total
-    img = np.where(inpaint_mask, 255, 0)
-    img = hole_fill(img.astype(np.uint8))
-    inpaint_mask = img / 255 * 1
-    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+        parse_mask = dilate_mask(parse_mask, 5, iterations=5)
+    parse_mask = parser_mask_changeable & ~parse_mask
+    parse_mask_total = parse_mask | parser_mask_fixed
+    img = np.where(parse_mask_total, 0, 255).astype(np.uint8)
+    img = hole_fill(img)
+    mask = Image.fromarray(img)
     return mask
 
+
 def preprocess_garment_image(input_path, output_path=None, save_image=False):
     """
     Preprocess a garment image by cropping to a centered square,
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compare the label space parsing postprocess against the original upsample-and-warp one
+"""
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import logging
+
+import cv2
+import numpy as np
+
+from parsing_api import ATR_INPUT_SIZE, LIP_INPUT_SIZE, get_input_transform, logits_to_labels, parse_images
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NUM_CLASSES = 20
+
+
+def synthetic_logits(input_size, rng, channel=NUM_CLASSES, cells=12):
+    # smooth logits at the network output resolution (a quarter of the input), with curved class boundaries
+    out_h, out_w = (input_size[0] + 3) // 4, (input_size[1] + 3) // 4
+    coarse = rng.standard_normal((cells, cells, channel)).astype(np.float32) * 4
+    logits = cv2.resize(coarse, (out_w, out_h), interpolation=cv2.INTER_CUBIC)
+    return np.ascontiguousarray(logits.transpose(2, 0, 1))
+
+
+def compare_labels(expected, actual):
+    expected = np.asarray(expected)
+    actual = np.asarray(actual)
+    assert expected.shape == actual.shape, (expected.shape, actual.shape)
+    return int((expected != actual).sum()), expected.size
+
+
+def check_synthetic(image_sizes, runs, seed=0):
+    rng = np.random.default_rng(seed)
+    mismatched, total = 0, 0
+    for input_size in (ATR_INPUT_SIZE, LIP_INPUT_SIZE):
+        for width, height in image_sizes:
+            for _ in range(runs):
+                center, scale, _ = get_input_transform(width, height, tuple(input_size))
+                meta = {'center': center, 'scale': scale, 'width': width, 'height': height}
+                logits = synthetic_logits(input_size, rng)
+                n, size = compare_labels(logits_to_labels(logits, meta, input_size, label_space=False),
+                                         logits_to_labels(logits, meta, input_size, label_space=True))
+                mismatched += n
+                total += size
+    return mismatched, total
+
+
+def check_images(atr_path, lip_path, images):
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(atr_path, providers=['CPUExecutionProvider'])
+    lip_session = ort.InferenceSession(lip_path, providers=['CPUExecutionProvider'])
+    expected = parse_images(session, lip_session, images, label_space=False)
+    actual = parse_images(session, lip_session, images, label_space=True)
+    mismatched, total = 0, 0
+    for (expected_image, _), (actual_image, _) in zip(expected, actual):
+        n, size = compare_labels(expected_image, actual_image)
+        mismatched += n
+        total += size
+    return mismatched, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--atr_path", default=None, help="with --lip_path and --images, compare parse_images")
+    parser.add_argument("--lip_path", default=None)
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--runs", type=int, default=4, help="synthetic logits per input and image size")
+    parser.add_argument("--max_mismatch", type=float, default=1e-5,
+                        help="fraction of pixels allowed to differ, warpAffine weights are 1/32 fixed point")
+    args = parser.parse_args()
+
+    if args.atr_path is not None:
+        mismatched, total = check_images(args.atr_path, args.lip_path, args.images)
+    else:
+        mismatched, total = check_synthetic([(768, 1024), (384, 512), (1024, 768)], args.runs)
+    logger.info("{} of {} pixels differ ({:.2e})".format(mismatched, total, mismatched / total))
+    assert mismatched <= args.max_mismatch * total, "label space parsing diverges from the original postprocess"
+
+
+if __name__ == "__main__":
+    main()
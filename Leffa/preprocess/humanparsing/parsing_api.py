@@ -5,16 +5,20 @@ import sys
 PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
 sys.path.insert(0, str(PROJECT_ROOT))
 import os
+from functools import lru_cache
 import torch
 import numpy as np
 import cv2
-import torchvision.transforms as transforms
-from torch.utils.data import DataLoader
-from datasets.simple_extractor_dataset import SimpleFolderDataset
-from utils.transforms import transform_logits
-from tqdm import tqdm
+from utils.transforms import get_affine_transform, transform_labels, transform_logits
 from PIL import Image
 
+ATR_INPUT_SIZE = (512, 512)
+LIP_INPUT_SIZE = (473, 473)
+LIP_HEAD_INPUT_SIZE = (256, 256)
+# BGR order, same as the SimpleFolderDataset transform used for training
+PARSING_MEAN = np.array([0.406, 0.456, 0.485], dtype=np.float32)
+PARSING_STD = np.array([0.225, 0.224, 0.229], dtype=np.float32)
+
 
 def get_palette(num_cls):
     """ Returns the color map for visualizing the segmentation mask.
@@ -118,61 +122,157 @@ def refine_hole(parsing_result_filled, parsing_result, arm_mask):
             cv2.drawContours(refine_hole_mask, contours, i, color=255, thickness=-1)
     return refine_hole_mask + arm_mask
 
-def onnx_inference(session, lip_session, input_dir):
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.406, 0.456, 0.485], std=[0.225, 0.224, 0.229])
-    ])
-    dataset = SimpleFolderDataset(root=input_dir, input_size=[512, 512], transform=transform)
-    dataloader = DataLoader(dataset)
+def load_bgr_image(image):
+    if isinstance(image, Image.Image):
+        return np.asarray(image)[:, :, [2, 1, 0]]
+    if isinstance(image, np.ndarray):
+        return image[:, :, [2, 1, 0]]
+    return cv2.imread(image, cv2.IMREAD_COLOR)
+
+
+@lru_cache(maxsize=64)
+def get_input_transform(width, height, input_size):
+    """ Person center, scale and affine warp of a whole (width, height) image into the network input.
+    Matches SimpleFolderDataset, cached so images of the same size share it.
+    """
+    aspect_ratio = input_size[1] * 1.0 / input_size[0]
+    w, h = width - 1, height - 1
+    center = np.zeros((2), dtype=np.float32)
+    center[0] = w * 0.5
+    center[1] = h * 0.5
+    if w > aspect_ratio * h:
+        h = w * 1.0 / aspect_ratio
+    elif w < aspect_ratio * h:
+        w = h * aspect_ratio
+    scale = np.array([w, h], dtype=np.float32)
+    trans = get_affine_transform(center, scale, 0, np.asarray(input_size))
+    return center, scale, trans
+
+
+def prepare_inputs(images, input_size):
+    inputs = []
+    metas = []
+    for img in images:
+        h, w, _ = img.shape
+        center, scale, trans = get_input_transform(w, h, tuple(input_size))
+        inputs.append(cv2.warpAffine(
+            img,
+            trans,
+            (int(input_size[1]), int(input_size[0])),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0)))
+        metas.append({'center': center, 'scale': scale, 'width': w, 'height': h})
+    inputs = np.stack(inputs).astype(np.float32) / 255.0
+    inputs = (inputs - PARSING_MEAN) / PARSING_STD
+    return np.ascontiguousarray(inputs.transpose(0, 3, 1, 2)), metas
+
+
+def run_session(session, inputs):
+    # batch along ORT's batch axis unless the graph has a fixed batch size
+    batch_dim = session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim != inputs.shape[0]:
+        return np.concatenate([session.run(None, {"input.1": x[None]})[1] for x in inputs])
+    return session.run(None, {"input.1": inputs})[1]
+
+
+def upsample_logits(logits, input_size):
+    upsample = torch.nn.Upsample(size=list(input_size), mode='bilinear', align_corners=True)
     with torch.no_grad():
-        for _, batch in enumerate(tqdm(dataloader)):
-            image, meta = batch
-            c = meta['center'].numpy()[0]
-            s = meta['scale'].numpy()[0]
-            w = meta['width'].numpy()[0]
-            h = meta['height'].numpy()[0]
-            output = session.run(None, {"input.1": image.numpy().astype(np.float32)})
-            upsample = torch.nn.Upsample(size=[512, 512], mode='bilinear', align_corners=True)
-            upsample_output = upsample(torch.from_numpy(output[1][0]).unsqueeze(0))
-            upsample_output = upsample_output.squeeze()
-            upsample_output = upsample_output.permute(1, 2, 0)  # CHW -> HWC
-            logits_result = transform_logits(upsample_output.data.cpu().numpy(), c, s, w, h, input_size=[512, 512])
-            parsing_result = np.argmax(logits_result, axis=2)
-            parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
-            # try holefilling the clothes part
-            arm_mask = (parsing_result == 14).astype(np.float32) \
-                       + (parsing_result == 15).astype(np.float32)
-            upper_cloth_mask = (parsing_result == 4).astype(np.float32) + arm_mask
-            img = np.where(upper_cloth_mask, 255, 0)
-            dst = hole_fill(img.astype(np.uint8))
-            parsing_result_filled = dst / 255 * 4
-            parsing_result_woarm = np.where(parsing_result_filled == 4, parsing_result_filled, parsing_result)
-            # add back arm and refined hole between arm and cloth
-            refine_hole_mask = refine_hole(parsing_result_filled.astype(np.uint8), parsing_result.astype(np.uint8),
-                                           arm_mask.astype(np.uint8))
-            parsing_result = np.where(refine_hole_mask, parsing_result, parsing_result_woarm)
-            # remove padding
-            parsing_result = parsing_result[1:-1, 1:-1]
-
-        dataset_lip = SimpleFolderDataset(root=input_dir, input_size=[473, 473], transform=transform)
-        dataloader_lip = DataLoader(dataset_lip)
-        with torch.no_grad():
-            for _, batch in enumerate(tqdm(dataloader_lip)):
-                image, meta = batch
-                c = meta['center'].numpy()[0]
-                s = meta['scale'].numpy()[0]
-                w = meta['width'].numpy()[0]
-                h = meta['height'].numpy()[0]
-
-                output_lip = lip_session.run(None, {"input.1": image.numpy().astype(np.float32)})
-                upsample = torch.nn.Upsample(size=[473, 473], mode='bilinear', align_corners=True)
-                upsample_output_lip = upsample(torch.from_numpy(output_lip[1][0]).unsqueeze(0))
-                upsample_output_lip = upsample_output_lip.squeeze()
-                upsample_output_lip = upsample_output_lip.permute(1, 2, 0)  # CHW -> HWC
-                logits_result_lip = transform_logits(upsample_output_lip.data.cpu().numpy(), c, s, w, h,
-                                                     input_size=[473, 473])
-                parsing_result_lip = np.argmax(logits_result_lip, axis=2)
+        upsample_output = upsample(torch.from_numpy(logits))
+    return upsample_output.permute(0, 2, 3, 1).numpy()  # NCHW -> NHWC
+
+
+def logits_to_labels(logits, meta, input_size, label_space=True):
+    """ Parse labels in image space from network logits (C, h, w).
+    label_space=False upsamples and warps every logit channel before the argmax, as the original SCHP code does.
+    """
+    if label_space:
+        return transform_labels(logits, meta['center'], meta['scale'], meta['width'], meta['height'],
+                                input_size=list(input_size))
+    logits = upsample_logits(logits[None], input_size)[0]
+    logits_result = transform_logits(logits, meta['center'], meta['scale'], meta['width'], meta['height'],
+                                     input_size=list(input_size))
+    return np.argmax(logits_result, axis=2)
+
+
+def atr_postprocess(logits, meta, input_size=ATR_INPUT_SIZE, label_space=True):
+    parsing_result = logits_to_labels(logits, meta, input_size, label_space)
+    parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
+    # try holefilling the clothes part
+    arm_mask = (parsing_result == 14).astype(np.float32) \
+               + (parsing_result == 15).astype(np.float32)
+    upper_cloth_mask = (parsing_result == 4).astype(np.float32) + arm_mask
+    img = np.where(upper_cloth_mask, 255, 0)
+    dst = hole_fill(img.astype(np.uint8))
+    parsing_result_filled = dst / 255 * 4
+    parsing_result_woarm = np.where(parsing_result_filled == 4, parsing_result_filled, parsing_result)
+    # add back arm and refined hole between arm and cloth
+    refine_hole_mask = refine_hole(parsing_result_filled.astype(np.uint8), parsing_result.astype(np.uint8),
+                                   arm_mask.astype(np.uint8))
+    parsing_result = np.where(refine_hole_mask, parsing_result, parsing_result_woarm)
+    # remove padding
+    return parsing_result[1:-1, 1:-1]
+
+
+def lip_postprocess(logits, meta, input_size=LIP_INPUT_SIZE, label_space=True):
+    return logits_to_labels(logits, meta, input_size, label_space)
+
+
+def parse_atr(session, images, label_space=True):
+    inputs, metas = prepare_inputs(images, ATR_INPUT_SIZE)
+    logits = run_session(session, inputs)
+    return [atr_postprocess(logit, meta, label_space=label_space) for logit, meta in zip(logits, metas)]
+
+
+def parse_lip(lip_session, images, label_space=True, input_size=LIP_INPUT_SIZE):
+    inputs, metas = prepare_inputs(images, input_size)
+    logits = run_session(lip_session, inputs)
+    return [lip_postprocess(logit, meta, input_size, label_space) for logit, meta in zip(logits, metas)]
+
+
+def get_head_box(parsing_result, margin=0.5):
+    """ Box (x0, y0, x1, y1) around the ATR face, grown by margin of its size on every side for context.
+    The neck is only looked for inside the ATR face, so LIP is not needed anywhere else.
+    """
+    ys, xs = np.nonzero(parsing_result == 11)
+    if len(ys) == 0:
+        return None
+    h, w = parsing_result.shape
+    x0, x1 = xs.min(), xs.max() + 1
+    y0, y1 = ys.min(), ys.max() + 1
+    mx = int((x1 - x0) * margin)
+    my = int((y1 - y0) * margin)
+    return max(0, x0 - mx), max(0, y0 - my), min(w, x1 + mx), min(h, y1 + my)
+
+
+def get_session_input_size(session, default):
+    # graphs exported with a fixed spatial shape only accept that size
+    shape = session.get_inputs()[0].shape[2:]
+    if all(isinstance(d, int) for d in shape):
+        return tuple(shape)
+    return default
+
+
+def parse_lip_heads(lip_session, images, atr_results, label_space=True, input_size=LIP_HEAD_INPUT_SIZE):
+    """ Runs LIP only on the head and neck crop given by the ATR result, at a smaller input size.
+    Outside the crop the returned labels are background.
+    """
+    input_size = get_session_input_size(lip_session, input_size)
+    lip_results = [np.zeros(img.shape[:2], dtype=np.int64) for img in images]
+    boxes = [get_head_box(atr_result) for atr_result in atr_results]
+    crops = [np.ascontiguousarray(img[box[1]:box[3], box[0]:box[2]])
+             for img, box in zip(images, boxes) if box is not None]
+    if len(crops) == 0:
+        return lip_results
+    crop_results = iter(parse_lip(lip_session, crops, label_space, input_size))
+    for lip_result, box in zip(lip_results, boxes):
+        if box is not None:
+            lip_result[box[1]:box[3], box[0]:box[2]] = next(crop_results)
+    return lip_results
+
+
+def merge_neck(parsing_result, parsing_result_lip):
     # add neck parsing result
     neck_mask = np.logical_and(np.logical_not((parsing_result_lip == 13).astype(np.float32)),
                                (parsing_result == 11).astype(np.float32))
@@ -181,8 +281,29 @@ def onnx_inference(session, lip_session, input_dir):
     output_img = Image.fromarray(np.asarray(parsing_result, dtype=np.uint8))
     output_img.putpalette(palette)
     face_mask = torch.from_numpy((parsing_result == 11).astype(np.float32))
-
     return output_img, face_mask
 
 
+def parse_images(session, lip_session, images, executor=None, label_space=True, lip_head_crop=False):
+    """ Parses a batch of images (PIL, RGB arrays or paths) in memory.
+    The ATR and LIP sessions run concurrently when an executor is given. With lip_head_crop, LIP runs after ATR
+    on the head crop only.
+    Returns a list of (parsing image, face mask).
+    """
+    images = [load_bgr_image(image) for image in images]
+    if lip_head_crop:
+        atr_results = parse_atr(session, images, label_space)
+        lip_results = parse_lip_heads(lip_session, images, atr_results, label_space)
+    elif executor is None:
+        atr_results = parse_atr(session, images, label_space)
+        lip_results = parse_lip(lip_session, images, label_space)
+    else:
+        atr_future = executor.submit(parse_atr, session, images, label_space)
+        lip_future = executor.submit(parse_lip, lip_session, images, label_space)
+        atr_results = atr_future.result()
+        lip_results = lip_future.result()
+    return [merge_neck(atr, lip) for atr, lip in zip(atr_results, lip_results)]
+
 
+def onnx_inference(session, lip_session, input_dir, executor=None, lip_head_crop=False):
+    return parse_images(session, lip_session, [input_dir], executor, lip_head_crop=lip_head_crop)[0]
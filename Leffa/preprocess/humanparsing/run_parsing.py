@@ -1,25 +1,37 @@
 from pathlib import Path
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import onnxruntime as ort
 PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
 sys.path.insert(0, str(PROJECT_ROOT))
-from parsing_api import onnx_inference
+from parsing_api import onnx_inference, parse_images
 
 
 class Parsing:
-    def __init__(self, atr_path, lip_path):
-        session_options = ort.SessionOptions()
-        session_options.inter_op_num_threads = os.cpu_count() // 2
-        session_options.intra_op_num_threads = os.cpu_count() // 2
-        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    def __init__(self, atr_path, lip_path, lip_head_crop=False, thread_budget=None):
+        # LIP is only used for the neck, lip_head_crop runs it on the ATR head crop only
+        self.lip_head_crop = lip_head_crop
+        if thread_budget is not None:
+            session_options = thread_budget.ort_session_options()
+        else:
+            session_options = ort.SessionOptions()
+            session_options.inter_op_num_threads = os.cpu_count() // 2
+            session_options.intra_op_num_threads = os.cpu_count() // 2
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
         self.session = ort.InferenceSession(atr_path,
                                             sess_options=session_options, providers=['CPUExecutionProvider'])
         self.lip_session = ort.InferenceSession(lip_path,
                                                 sess_options=session_options, providers=['CPUExecutionProvider'])
+        # ATR and LIP run concurrently, ORT releases the GIL during inference
+        self.executor = ThreadPoolExecutor(max_workers=2)
 
     def __call__(self, input_image):
         parsed_image, face_mask = onnx_inference(
-            self.session, self.lip_session, input_image)
+            self.session, self.lip_session, input_image, self.executor, self.lip_head_crop)
         return parsed_image, face_mask
+
+    def batch(self, input_images):
+        return parse_images(self.session, self.lip_session, input_images, self.executor,
+                            lip_head_crop=self.lip_head_crop)
@@ -97,6 +97,97 @@ def transform_logits(logits, center, scale, width, height, input_size):
     return target_logits
 
 
+def _linear_indices(in_size, out_size):
+    # source indices and weights of bilinear upsampling with align_corners=True, as computed by torch
+    if out_size > 1:
+        scale = np.float32(in_size - 1) / np.float32(out_size - 1)
+    else:
+        scale = np.float32(0)
+    src = scale * np.arange(out_size, dtype=np.float32)
+    index0 = src.astype(np.int64)
+    index1 = np.where(index0 < in_size - 1, index0 + 1, index0)
+    lambda1 = np.clip(src - index0, 0, 1).astype(np.float32)
+    return index0, index1, lambda1
+
+
+def _upsampled_logits(logits, rows, cols, y, x):
+    # logits of the upsampled map at pixels (y, x) only, shape (len(y), channel)
+    r0, r1, rl = rows
+    c0, c1, cl = cols
+    y0, y1, ly = r0[y], r1[y], rl[y]
+    x0, x1, lx = c0[x], c1[x], cl[x]
+    top = logits[:, y0, x0] * (1 - lx) + logits[:, y0, x1] * lx
+    bottom = logits[:, y1, x0] * (1 - lx) + logits[:, y1, x1] * lx
+    return (top * (1 - ly) + bottom * ly).T
+
+
+def transform_labels(logits, center, scale, width, height, input_size):
+    """
+    Label map of `np.argmax(transform_logits(...), axis=2)` for network logits (channel, h, w) that would be
+    upsampled to input_size with bilinear align_corners=True, without building the upsampled or warped logits.
+    A pixel whose whole interpolation support shares one argmax gets that label directly, only pixels next to
+    class boundaries (or the network input border) blend the logits at full precision.
+    warpAffine rounds the source position to 1/32 of a pixel and blends with the weights of that grid, so a
+    boundary pixel whose two best logits are closer than that rounding can take the other label. A handful of
+    pixels per image differ for that reason, see check_label_space.py.
+    """
+    channel, in_h, in_w = logits.shape
+    out_h, out_w = int(input_size[0]), int(input_size[1])
+    width, height = int(width), int(height)
+    rows = _linear_indices(in_h, out_h)
+    cols = _linear_indices(in_w, out_w)
+
+    # labels of the upsampled map where the 2x2 upsampling support agrees, -1 elsewhere
+    labels = np.argmax(logits, axis=0)
+    r0, r1, _ = rows
+    c0, c1, _ = cols
+    l00 = labels[r0][:, c0]
+    l01 = labels[r0][:, c1]
+    l10 = labels[r1][:, c0]
+    l11 = labels[r1][:, c1]
+    input_labels = np.where((l00 == l01) & (l00 == l10) & (l00 == l11), l00, -1)
+
+    # position of every image pixel in the network input
+    trans = get_affine_transform(center, scale, 0, input_size, inv=1)
+    inv_trans = cv2.invertAffineTransform(trans)
+    xs, ys = np.meshgrid(np.arange(width), np.arange(height))
+    src_x = inv_trans[0, 0] * xs + inv_trans[0, 1] * ys + inv_trans[0, 2]
+    src_y = inv_trans[1, 0] * xs + inv_trans[1, 1] * ys + inv_trans[1, 2]
+    x0 = np.floor(src_x).astype(np.int64)
+    y0 = np.floor(src_y).astype(np.int64)
+
+    inside = (x0 >= 0) & (x0 < out_w - 1) & (y0 >= 0) & (y0 < out_h - 1)
+    # all four neighbours outside, warpAffine blends zeros only and argmax is 0
+    outside = (x0 < -1) | (x0 >= out_w) | (y0 < -1) | (y0 >= out_h)
+    xi = np.clip(x0, 0, out_w - 2)
+    yi = np.clip(y0, 0, out_h - 2)
+    n00 = input_labels[yi, xi]
+    uniform = inside & (n00 >= 0) \
+        & (n00 == input_labels[yi, xi + 1]) \
+        & (n00 == input_labels[yi + 1, xi]) \
+        & (n00 == input_labels[yi + 1, xi + 1])
+
+    target_labels = np.zeros((height, width), dtype=np.int64)
+    target_labels[uniform] = n00[uniform]
+
+    boundary = ~uniform & ~outside
+    if boundary.any():
+        bx0 = x0[boundary]
+        by0 = y0[boundary]
+        fx = (src_x[boundary] - bx0).astype(np.float32)
+        fy = (src_y[boundary] - by0).astype(np.float32)
+        blended = np.zeros((len(bx0), channel), dtype=np.float32)
+        for dy, dx, weight in ((0, 0, (1 - fy) * (1 - fx)), (0, 1, (1 - fy) * fx),
+                               (1, 0, fy * (1 - fx)), (1, 1, fy * fx)):
+            y = by0 + dy
+            x = bx0 + dx
+            valid = (y >= 0) & (y < out_h) & (x >= 0) & (x < out_w)
+            blended[valid] += weight[valid, None] * _upsampled_logits(logits, rows, cols, y[valid], x[valid])
+        target_labels[boundary] = np.argmax(blended, axis=1)
+
+    return target_labels
+
+
 def get_affine_transform(center,
                          scale,
                          rot,
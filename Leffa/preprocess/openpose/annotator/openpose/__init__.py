@@ -12,7 +12,7 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 import torch
 import numpy as np
 from . import util
-from .body import Body
+from .body import Body, OnnxBody, TRYON_LIMBS
 from .hand import Hand
 from .face import Face
 from annotator.util import annotator_ckpts_path
@@ -60,16 +60,19 @@ class OpenposeDetector:
         #     from basicsr.utils.download_util import load_file_from_url
         #     load_file_from_url(face_model_path, model_dir=annotator_ckpts_path)
 
-        self.body_estimation = Body(body_modelpath)
+        if body_modelpath.endswith(".onnx"):
+            self.body_estimation = OnnxBody(body_modelpath)
+        else:
+            self.body_estimation = Body(body_modelpath)
         # self.hand_estimation = Hand(hand_modelpath)
         # self.face_estimation = Face(face_modelpath)
 
 
-    def __call__(self, oriImg, hand_and_face=False, return_is_index=False):
+    def __call__(self, oriImg, hand_and_face=False, return_is_index=False, tryon_keypoints=False):
         oriImg = oriImg[:, :, ::-1].copy()
         H, W, C = oriImg.shape
         with torch.no_grad():
-            candidate, subset = self.body_estimation(oriImg)
+            candidate, subset = self.body_estimation(oriImg, limbs=TRYON_LIMBS if tryon_keypoints else None)
             hands = []
             faces = []
             if hand_and_face:
@@ -7,16 +7,189 @@ import cv2
 import numpy as np
 import math
 import time
-from scipy.ndimage.filters import gaussian_filter
 import matplotlib.pyplot as plt
 import matplotlib
 import torch
+import torch.nn.functional as F
 from torchvision import transforms
 
 from . import util
 from .model import bodypose_model
 
 
+# find connection in the specified sequence, center 29 is in the position 15
+LIMB_SEQ = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
+            [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
+            [1, 16], [16, 18], [3, 17], [6, 18]]
+# the middle joints heatmap correpondence
+MAP_IDX = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
+           [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
+           [55, 56], [37, 38], [45, 46]]
+# the agnostic masks only read the shoulders, elbows and wrists (parts 2-7),
+# the neck-shoulder limbs are kept to group them into people
+TRYON_LIMBS = [0, 1, 2, 3, 4, 5]
+
+
+def gaussian_kernel1d(sigma, truncate=4.0):
+    # same taps as scipy.ndimage.gaussian_filter
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 / (sigma * sigma) * x ** 2)
+    return kernel / kernel.sum()
+
+
+def reflect_indices(size, radius):
+    # scipy's "reflect" mode, d c b a | a b c d | d c b a
+    index = np.arange(-radius, size + radius) % (2 * size)
+    return np.where(index >= size, 2 * size - 1 - index, index)
+
+
+def gaussian_blur(maps, sigma):
+    """Separable gaussian blur of a (C, H, W) tensor, matching scipy.ndimage.gaussian_filter."""
+    kernel = torch.from_numpy(gaussian_kernel1d(sigma)).to(maps)
+    radius = (len(kernel) - 1) // 2
+    C, H, W = maps.shape
+    rows = torch.from_numpy(reflect_indices(H, radius)).to(maps.device)
+    cols = torch.from_numpy(reflect_indices(W, radius)).to(maps.device)
+    x = maps[:, None].index_select(2, rows)
+    x = F.conv2d(x, kernel.view(1, 1, -1, 1))
+    x = x.index_select(3, cols)
+    x = F.conv2d(x, kernel.view(1, 1, 1, -1))
+    return x[:, 0]
+
+
+def find_peaks(heatmaps, thre, sigma=3):
+    """
+    Finds the local maxima of all parts at once.
+    heatmaps: (C, H, W) tensor, one channel per part.
+    Returns an (N, 5) float64 array of (part, x, y, score, id) sorted by part, then y, then x.
+    """
+    blurred = gaussian_blur(heatmaps, sigma)[None]
+    # max over the 4-neighbourhood, the borders are padded with -inf
+    neighbours = torch.maximum(F.max_pool2d(blurred, (3, 1), stride=1, padding=(1, 0)),
+                               F.max_pool2d(blurred, (1, 3), stride=1, padding=(0, 1)))
+    peaks_binary = (blurred >= neighbours) & (blurred > thre)
+    part, y, x = peaks_binary[0].nonzero(as_tuple=True)
+    score = heatmaps[part, y, x]
+    peak_id = torch.arange(len(part), device=heatmaps.device)
+    peaks = torch.stack([part, x, y], dim=1).to(score.dtype)
+    return torch.cat([peaks, score[:, None], peak_id[:, None].to(score.dtype)], dim=1).cpu().numpy()
+
+
+def score_limb(candA, candB, score_mid, image_height, thre2, mid_num=10):
+    """
+    Scores all (candA, candB) pairs of one limb along its PAF and greedily keeps the best disjoint ones.
+    candA, candB: (n, 4) arrays of (x, y, score, id). score_mid: (H, W, 2) PAF of the limb.
+    Returns an (n, 5) array of (idA, idB, score, i, j), same as the pairwise loop it replaces.
+    """
+    nA, nB = len(candA), len(candB)
+    start = np.broadcast_to(candA[:, None, :2], (nA, nB, 2))
+    end = np.broadcast_to(candB[None, :, :2], (nA, nB, 2))
+    vec = end - start
+    norm = np.maximum(0.001, np.sqrt(vec[..., 0] * vec[..., 0] + vec[..., 1] * vec[..., 1]))
+    vec = vec / norm[..., None]
+
+    # np.linspace per pair, (mid_num, nA, nB, 2)
+    startend = np.arange(0, mid_num, dtype=np.float64).reshape(-1, 1, 1, 1) * ((end - start) / (mid_num - 1)) + start
+    startend[-1] = end
+    # python's round() is half to even, like np.rint
+    startend = np.rint(startend).astype(int)
+    vec_x = score_mid[startend[..., 1], startend[..., 0], 0]
+    vec_y = score_mid[startend[..., 1], startend[..., 0], 1]
+    score_midpts = vec_x * vec[..., 0] + vec_y * vec[..., 1]
+
+    # summed in order, like the builtin sum()
+    score_sum = 0
+    for I in range(mid_num):
+        score_sum = score_sum + score_midpts[I]
+    score_with_dist_prior = score_sum / mid_num + np.minimum(0.5 * image_height / norm - 1, 0)
+    criterion1 = (score_midpts > thre2).sum(axis=0) > 0.8 * mid_num
+    criterion2 = score_with_dist_prior > 0
+
+    i, j = np.nonzero(criterion1 & criterion2)
+    s = score_with_dist_prior[i, j]
+    # stable, so ties keep the (i, j) order like sorted(..., reverse=True)
+    order = np.argsort(-s, kind="stable")
+
+    connection = []
+    usedA = np.zeros(nA, dtype=bool)
+    usedB = np.zeros(nB, dtype=bool)
+    for c in order:
+        if not usedA[i[c]] and not usedB[j[c]]:
+            usedA[i[c]] = usedB[j[c]] = True
+            connection.append([candA[i[c], 3], candB[j[c], 3], s[c], i[c], j[c]])
+            if len(connection) >= min(nA, nB):
+                break
+    return np.array(connection, dtype=np.float64).reshape(-1, 5)
+
+
+def assemble_people(candidate, connection_all, limbSeq, num_parts=18, min_parts=4, min_mean_score=0.4):
+    """
+    Groups the limb connections into people, and drops the ones with fewer than min_parts parts
+    or a mean score below min_mean_score.
+    Returns an (n, num_parts + 2) array, 0..num_parts-1 are the indices in candidate,
+    then the total score and the number of parts of each person.
+    """
+    # every connection creates at most one person, merged people are only marked dead to keep the order
+    capacity = sum(len(connection) for connection in connection_all)
+    subset = -1 * np.ones((capacity, num_parts + 2))
+    alive = np.zeros(capacity, dtype=bool)
+    n = 0
+
+    for k in range(len(limbSeq)):
+        if not len(connection_all[k]):
+            continue
+        partAs = connection_all[k][:, 0]
+        partBs = connection_all[k][:, 1]
+        indexA, indexB = np.array(limbSeq[k]) - 1
+
+        for i in range(len(connection_all[k])):
+            subset_idx = np.nonzero(alive[:n] & ((subset[:n, indexA] == partAs[i]) | (subset[:n, indexB] == partBs[i])))[0]
+            found = len(subset_idx)
+
+            if found == 1:
+                j = subset_idx[0]
+                if subset[j][indexB] != partBs[i]:
+                    subset[j][indexB] = partBs[i]
+                    subset[j][-1] += 1
+                    subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+            elif found == 2:  # if found 2 and disjoint, merge them
+                j1, j2 = subset_idx
+                membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
+                if len(np.nonzero(membership == 2)[0]) == 0:  # merge
+                    subset[j1][:-2] += (subset[j2][:-2] + 1)
+                    subset[j1][-2:] += subset[j2][-2:]
+                    subset[j1][-2] += connection_all[k][i][2]
+                    alive[j2] = False
+                else:  # as like found == 1
+                    subset[j1][indexB] = partBs[i]
+                    subset[j1][-1] += 1
+                    subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+
+            # if find no partA in the subset, create a new subset
+            elif not found and k < 17:
+                subset[n][indexA] = partAs[i]
+                subset[n][indexB] = partBs[i]
+                subset[n][-1] = 2
+                subset[n][-2] = sum(candidate[connection_all[k][i, :2].astype(int), 2]) + connection_all[k][i][2]
+                alive[n] = True
+                n += 1
+
+    subset = subset[:n][alive[:n]]
+    # delete some rows of subset which has few parts occur
+    keep = ~((subset[:, -1] < min_parts) | (subset[:, -2] / np.maximum(subset[:, -1], 1) < min_mean_score))
+    return subset[keep]
+
+
+def prepare_input(oriImg, scale, stride=8, padValue=128):
+    """Scales and pads a BGR image into the (1, 3, H, W) float32 network input."""
+    imageToTest = util.smart_resize_k(oriImg, fx=scale, fy=scale)
+    imageToTest_padded, pad = util.padRightDownCorner(imageToTest, stride, padValue)
+    im = np.transpose(np.float32(imageToTest_padded[:, :, :, np.newaxis]), (3, 2, 0, 1)) / 256 - 0.5
+    im = np.ascontiguousarray(im)
+    return im, imageToTest_padded, pad
+
+
 class Body(object):
     def __init__(self, model_path):
         self.model = bodypose_model()
@@ -25,9 +198,22 @@ class Body(object):
         model_dict = util.transfer(self.model, torch.load(model_path))
         self.model.load_state_dict(model_dict)
         self.model.eval()
+        self.device = next(self.model.parameters()).device
 
-
-    def __call__(self, oriImg):
+    def infer(self, im):
+        """Runs the network, returns the PAFs and the heatmaps."""
+        data = torch.from_numpy(im).float()
+        if torch.cuda.is_available():
+            data = data.cuda()
+        # data = data.permute([2, 0, 1]).unsqueeze(0).float()
+        with torch.no_grad():
+            return self.model(data)
+
+    def __call__(self, oriImg, limbs=None):
+        """
+        limbs: indices in LIMB_SEQ to detect, all of them by default. Only their parts and PAF
+        channels are resized and searched, the other parts are left empty (e.g. TRYON_LIMBS).
+        """
         # scale_search = [0.5, 1.0, 1.5, 2.0]
         scale_search = [0.5]
         boxsize = 368
@@ -35,188 +221,84 @@ class Body(object):
         padValue = 128
         thre1 = 0.1
         thre2 = 0.05
+        if limbs is None:
+            limbs = range(len(LIMB_SEQ))
+            parts = list(range(18))
+        else:
+            parts = sorted({part - 1 for k in limbs for part in LIMB_SEQ[k]})
+        # heatmap channels of the parts, then the two PAF channels of each limb
+        channels = parts + [x for k in limbs for x in MAP_IDX[k]]
         multiplier = [x * boxsize / oriImg.shape[0] for x in scale_search]
-        heatmap_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 19))
-        paf_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 38))
+        heatmap_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], len(parts)))
+        paf_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 2 * len(limbs)))
 
         for m in range(len(multiplier)):
             scale = multiplier[m]
-            imageToTest = util.smart_resize_k(oriImg, fx=scale, fy=scale)
-            imageToTest_padded, pad = util.padRightDownCorner(imageToTest, stride, padValue)
-            im = np.transpose(np.float32(imageToTest_padded[:, :, :, np.newaxis]), (3, 2, 0, 1)) / 256 - 0.5
-            im = np.ascontiguousarray(im)
-
-            data = torch.from_numpy(im).float()
-            if torch.cuda.is_available():
-                data = data.cuda()
-            # data = data.permute([2, 0, 1]).unsqueeze(0).float()
-            with torch.no_grad():
-                Mconv7_stage6_L1, Mconv7_stage6_L2 = self.model(data)
-
-            Mconv7_stage6_L1 = Mconv7_stage6_L1.cpu().numpy()
-            Mconv7_stage6_L2 = Mconv7_stage6_L2.cpu().numpy()
-
-            # extract outputs, resize, and remove padding
-            # heatmap = np.transpose(np.squeeze(net.blobs[output_blobs.keys()[1]].data), (1, 2, 0))  # output 1 is heatmaps
-            heatmap = np.transpose(np.squeeze(Mconv7_stage6_L2), (1, 2, 0))  # output 1 is heatmaps
-            heatmap = util.smart_resize_k(heatmap, fx=stride, fy=stride)
-            heatmap = heatmap[:imageToTest_padded.shape[0] - pad[2], :imageToTest_padded.shape[1] - pad[3], :]
-            heatmap = util.smart_resize(heatmap, (oriImg.shape[0], oriImg.shape[1]))
-
-            # paf = np.transpose(np.squeeze(net.blobs[output_blobs.keys()[0]].data), (1, 2, 0))  # output 0 is PAFs
-            paf = np.transpose(np.squeeze(Mconv7_stage6_L1), (1, 2, 0))  # output 0 is PAFs
-            paf = util.smart_resize_k(paf, fx=stride, fy=stride)
-            paf = paf[:imageToTest_padded.shape[0] - pad[2], :imageToTest_padded.shape[1] - pad[3], :]
-            paf = util.smart_resize(paf, (oriImg.shape[0], oriImg.shape[1]))
+            im, imageToTest_padded, pad = prepare_input(oriImg, scale, stride, padValue)
+            Mconv7_stage6_L1, Mconv7_stage6_L2 = self.infer(im)
+
+            # heatmaps and PAFs are resized together, all channels in one cv2.resize call per step
+            maps = torch.cat([Mconv7_stage6_L2, Mconv7_stage6_L1], dim=1)[0, channels].permute(1, 2, 0).contiguous().cpu().numpy()
+            maps = util.smart_resize_k(maps, fx=stride, fy=stride)
+            maps = maps[:imageToTest_padded.shape[0] - pad[2], :imageToTest_padded.shape[1] - pad[3], :]
+            maps = util.smart_resize(maps, (oriImg.shape[0], oriImg.shape[1]))
+            heatmap, paf = maps[:, :, :len(parts)], maps[:, :, len(parts):]
 
             heatmap_avg += heatmap_avg + heatmap / len(multiplier)
             paf_avg += + paf / len(multiplier)
 
-        all_peaks = []
-        peak_counter = 0
-
-        for part in range(18):
-            map_ori = heatmap_avg[:, :, part]
-            one_heatmap = gaussian_filter(map_ori, sigma=3)
-
-            map_left = np.zeros(one_heatmap.shape)
-            map_left[1:, :] = one_heatmap[:-1, :]
-            map_right = np.zeros(one_heatmap.shape)
-            map_right[:-1, :] = one_heatmap[1:, :]
-            map_up = np.zeros(one_heatmap.shape)
-            map_up[:, 1:] = one_heatmap[:, :-1]
-            map_down = np.zeros(one_heatmap.shape)
-            map_down[:, :-1] = one_heatmap[:, 1:]
-
-            peaks_binary = np.logical_and.reduce(
-                (one_heatmap >= map_left, one_heatmap >= map_right, one_heatmap >= map_up, one_heatmap >= map_down,
-                 one_heatmap > thre1))
-            peaks = list(zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]))  # note reverse
-            peaks_with_score = [x + (map_ori[x[1], x[0]],) for x in peaks]
-            peak_id = range(peak_counter, peak_counter + len(peaks))
-            peaks_with_score_and_id = [peaks_with_score[i] + (peak_id[i],) for i in range(len(peak_id))]
-
-            all_peaks.append(peaks_with_score_and_id)
-            peak_counter += len(peaks)
-
-        # find connection in the specified sequence, center 29 is in the position 15
-        limbSeq = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
-                   [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
-                   [1, 16], [16, 18], [3, 17], [6, 18]]
-        # the middle joints heatmap correpondence
-        mapIdx = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
-                  [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
-                  [55, 56], [37, 38], [45, 46]]
-
-        connection_all = []
-        special_k = []
-        mid_num = 10
-
-        for k in range(len(mapIdx)):
-            score_mid = paf_avg[:, :, [x - 19 for x in mapIdx[k]]]
-            candA = all_peaks[limbSeq[k][0] - 1]
-            candB = all_peaks[limbSeq[k][1] - 1]
-            nA = len(candA)
-            nB = len(candB)
-            indexA, indexB = limbSeq[k]
-            if (nA != 0 and nB != 0):
-                connection_candidate = []
-                for i in range(nA):
-                    for j in range(nB):
-                        vec = np.subtract(candB[j][:2], candA[i][:2])
-                        norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1])
-                        norm = max(0.001, norm)
-                        vec = np.divide(vec, norm)
-
-                        startend = list(zip(np.linspace(candA[i][0], candB[j][0], num=mid_num), \
-                                            np.linspace(candA[i][1], candB[j][1], num=mid_num)))
-
-                        vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0] \
-                                          for I in range(len(startend))])
-                        vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1] \
-                                          for I in range(len(startend))])
-
-                        score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
-                        score_with_dist_prior = sum(score_midpts) / len(score_midpts) + min(
-                            0.5 * oriImg.shape[0] / norm - 1, 0)
-                        criterion1 = len(np.nonzero(score_midpts > thre2)[0]) > 0.8 * len(score_midpts)
-                        criterion2 = score_with_dist_prior > 0
-                        if criterion1 and criterion2:
-                            connection_candidate.append(
-                                [i, j, score_with_dist_prior, score_with_dist_prior + candA[i][2] + candB[j][2]])
-
-                connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
-                connection = np.zeros((0, 5))
-                for c in range(len(connection_candidate)):
-                    i, j, s = connection_candidate[c][0:3]
-                    if (i not in connection[:, 3] and j not in connection[:, 4]):
-                        connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
-                        if (len(connection) >= min(nA, nB)):
-                            break
-
-                connection_all.append(connection)
-            else:
-                special_k.append(k)
-                connection_all.append([])
+        # peak search runs on the model device, in float64 like the maps
+        heatmaps = torch.from_numpy(heatmap_avg).permute(2, 0, 1)
+        if self.device.type != "cpu":
+            heatmaps = heatmaps.to(self.device)
+        peaks = find_peaks(heatmaps, thre1)
+        peaks[:, 0] = np.array(parts)[peaks[:, 0].astype(int)]
+        all_peaks = [peaks[peaks[:, 0] == part, 1:] for part in range(18)]
+
+        connection_all = [[] for _ in LIMB_SEQ]
+        for c, k in enumerate(limbs):
+            candA = all_peaks[LIMB_SEQ[k][0] - 1]
+            candB = all_peaks[LIMB_SEQ[k][1] - 1]
+            if len(candA) != 0 and len(candB) != 0:
+                # the x and y channels of a limb are adjacent, slice a view instead of copying them
+                score_mid = paf_avg[:, :, 2 * c:2 * c + 2]
+                connection_all[k] = score_limb(candA, candB, score_mid, oriImg.shape[0], thre2)
 
         # last number in each row is the total parts number of that person
         # the second last number in each row is the score of the overall configuration
-        subset = -1 * np.ones((0, 20))
-        candidate = np.array([item for sublist in all_peaks for item in sublist])
-
-        for k in range(len(mapIdx)):
-            if k not in special_k:
-                partAs = connection_all[k][:, 0]
-                partBs = connection_all[k][:, 1]
-                indexA, indexB = np.array(limbSeq[k]) - 1
-
-                for i in range(len(connection_all[k])):  # = 1:size(temp,1)
-                    found = 0
-                    subset_idx = [-1, -1]
-                    for j in range(len(subset)):  # 1:size(subset,1):
-                        if subset[j][indexA] == partAs[i] or subset[j][indexB] == partBs[i]:
-                            subset_idx[found] = j
-                            found += 1
-
-                    if found == 1:
-                        j = subset_idx[0]
-                        if subset[j][indexB] != partBs[i]:
-                            subset[j][indexB] = partBs[i]
-                            subset[j][-1] += 1
-                            subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
-                    elif found == 2:  # if found 2 and disjoint, merge them
-                        j1, j2 = subset_idx
-                        membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
-                        if len(np.nonzero(membership == 2)[0]) == 0:  # merge
-                            subset[j1][:-2] += (subset[j2][:-2] + 1)
-                            subset[j1][-2:] += subset[j2][-2:]
-                            subset[j1][-2] += connection_all[k][i][2]
-                            subset = np.delete(subset, j2, 0)
-                        else:  # as like found == 1
-                            subset[j1][indexB] = partBs[i]
-                            subset[j1][-1] += 1
-                            subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
-
-                    # if find no partA in the subset, create a new subset
-                    elif not found and k < 17:
-                        row = -1 * np.ones(20)
-                        row[indexA] = partAs[i]
-                        row[indexB] = partBs[i]
-                        row[-1] = 2
-                        row[-2] = sum(candidate[connection_all[k][i, :2].astype(int), 2]) + connection_all[k][i][2]
-                        subset = np.vstack([subset, row])
-        # delete some rows of subset which has few parts occur
-        deleteIdx = []
-        for i in range(len(subset)):
-            if subset[i][-1] < 4 or subset[i][-2] / subset[i][-1] < 0.4:
-                deleteIdx.append(i)
-        subset = np.delete(subset, deleteIdx, axis=0)
+        candidate = peaks[:, 1:]
+        # at least 4 of the 18 parts, scaled down when only some of them can be found: with
+        # TRYON_LIMBS a neck and two shoulders must be kept, their head parts are never searched
+        min_parts = max(2, int(np.ceil(4 * len(parts) / 18)))
+        subset = assemble_people(candidate, connection_all, LIMB_SEQ, min_parts=min_parts)
 
         # subset: n*20 array, 0-17 is the index in candidate, 18 is the total score, 19 is the total parts
         # candidate: x, y, score, id
         return candidate, subset
 
 
+class OnnxBody(Body):
+    """
+    Body backed by an ONNX Runtime session, see preprocess/openpose/export_onnx.py.
+    The graph may be int8 quantized, the post-processing is the same as Body.
+    """
+
+    def __init__(self, model_path, session_options=None, providers=None):
+        import onnxruntime as ort
+
+        if session_options is None:
+            session_options = ort.SessionOptions()
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=session_options,
+                                            providers=providers or ['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = torch.device("cpu")
+
+    def infer(self, im):
+        paf, heatmap = self.session.run(None, {self.input_name: im})
+        return torch.from_numpy(paf), torch.from_numpy(heatmap)
+
+
 # if __name__ == "__main__":
 #     body_estimation = Body('../model/body_pose_model.pth')
 
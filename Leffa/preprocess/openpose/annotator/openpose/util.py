@@ -7,32 +7,31 @@ import cv2
 eps = 0.01
 
 
+# cv2.resize handles up to CV_CN_MAX interleaved channels in a single call
+CV_CN_MAX = 512
+
+
+def resize_channels(x, size, interpolation):
+    """Resizes an HxWxC map with any number of channels in as few cv2.resize calls as possible."""
+    Wt, Ht = size
+    if x.ndim == 2 or x.shape[2] <= CV_CN_MAX:
+        return cv2.resize(x, (Wt, Ht), interpolation=interpolation)
+    return np.concatenate([cv2.resize(x[:, :, i:i + CV_CN_MAX], (Wt, Ht), interpolation=interpolation).reshape(Ht, Wt, -1)
+                           for i in range(0, x.shape[2], CV_CN_MAX)], axis=2)
+
+
 def smart_resize(x, s):
     Ht, Wt = s
-    if x.ndim == 2:
-        Ho, Wo = x.shape
-        Co = 1
-    else:
-        Ho, Wo, Co = x.shape
-    if Co == 3 or Co == 1:
-        k = float(Ht + Wt) / float(Ho + Wo)
-        return cv2.resize(x, (int(Wt), int(Ht)), interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LANCZOS4)
-    else:
-        return np.stack([smart_resize(x[:, :, i], s) for i in range(Co)], axis=2)
+    Ho, Wo = x.shape[:2]
+    k = float(Ht + Wt) / float(Ho + Wo)
+    return resize_channels(x, (int(Wt), int(Ht)), interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LANCZOS4)
 
 
 def smart_resize_k(x, fx, fy):
-    if x.ndim == 2:
-        Ho, Wo = x.shape
-        Co = 1
-    else:
-        Ho, Wo, Co = x.shape
+    Ho, Wo = x.shape[:2]
     Ht, Wt = Ho * fy, Wo * fx
-    if Co == 3 or Co == 1:
-        k = float(Ht + Wt) / float(Ho + Wo)
-        return cv2.resize(x, (int(Wt), int(Ht)), interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LANCZOS4)
-    else:
-        return np.stack([smart_resize_k(x[:, :, i], fx, fy) for i in range(Co)], axis=2)
+    k = float(Ht + Wt) / float(Ho + Wo)
+    return resize_channels(x, (int(Wt), int(Ht)), interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LANCZOS4)
 
 
 def padRightDownCorner(img, stride, padValue):
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Check that the packed smart_resize/smart_resize_k match the original per channel resizing
+"""
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT.parents[1]))
+
+import argparse
+import logging
+
+import cv2
+import numpy as np
+
+from preprocess.openpose.annotator.openpose import util
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# the per channel recursion smart_resize/smart_resize_k replaced
+def reference_smart_resize(x, s):
+    Ht, Wt = s
+    if x.ndim == 2:
+        Ho, Wo = x.shape
+        Co = 1
+    else:
+        Ho, Wo, Co = x.shape
+    if Co == 3 or Co == 1:
+        k = float(Ht + Wt) / float(Ho + Wo)
+        return cv2.resize(x, (int(Wt), int(Ht)), interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LANCZOS4)
+    else:
+        return np.stack([reference_smart_resize(x[:, :, i], s) for i in range(Co)], axis=2)
+
+
+def reference_smart_resize_k(x, fx, fy):
+    if x.ndim == 2:
+        Ho, Wo = x.shape
+        Co = 1
+    else:
+        Ho, Wo, Co = x.shape
+    Ht, Wt = Ho * fy, Wo * fx
+    if Co == 3 or Co == 1:
+        k = float(Ht + Wt) / float(Ho + Wo)
+        return cv2.resize(x, (int(Wt), int(Ht)), interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LANCZOS4)
+    else:
+        return np.stack([reference_smart_resize_k(x[:, :, i], fx, fy) for i in range(Co)], axis=2)
+
+
+def check(name, expected, actual):
+    assert expected.shape == actual.shape and expected.dtype == actual.dtype, \
+        "{}: {} {} != {} {}".format(name, expected.shape, expected.dtype, actual.shape, actual.dtype)
+    assert np.array_equal(expected, actual), "{}: max difference {}".format(
+        name, np.abs(expected.astype(np.float64) - actual.astype(np.float64)).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for run in range(args.runs):
+        # the Body input image, then its 19 heatmap + 38 PAF channels at stride 8, as Body.__call__ resizes them
+        h, w = rng.integers(120, 260, size=2)
+        image = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+        scale = 0.5 * 368 / h
+        check("image", reference_smart_resize_k(image, scale, scale), util.smart_resize_k(image, scale, scale))
+
+        maps = rng.standard_normal((h // 8 + 1, w // 8 + 1, 57)).astype(np.float32)
+        upsampled = util.smart_resize_k(maps, fx=8, fy=8)
+        check("maps x8", reference_smart_resize_k(maps, 8, 8), upsampled)
+        for size in ((h, w), (h * 2, w * 2), (h // 2, w // 2)):
+            check("maps to {}".format(size), reference_smart_resize(upsampled, size), util.smart_resize(upsampled, size))
+        # more channels than a single cv2.resize takes
+        wide = rng.standard_normal((16, 12, util.CV_CN_MAX + 5)).astype(np.float32)
+        check("wide maps", reference_smart_resize(wide, (32, 24)), util.smart_resize(wide, (32, 24)))
+        logger.info("Run {}: packed resizing matches the per channel recursion".format(run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compare the try-on keypoints mode of OpenPose against the full body mode on person images
+"""
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT.parents[1]))
+
+import argparse
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+from preprocess.openpose.run_openpose import OpenPose
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# neck, shoulders, elbows and wrists, the joints the agnostic masks read
+TRYON_JOINTS = list(range(1, 8))
+
+
+def list_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--body_model_path", default="./ckpts/openpose/body_pose_model.pth")
+    parser.add_argument("--images", nargs="+", required=True, help="person images or folders of them")
+    parser.add_argument("--max_mismatch", type=float, default=0.0,
+                        help="fraction of images allowed to differ on joints 1-7")
+    args = parser.parse_args()
+
+    full = OpenPose(args.body_model_path)
+    tryon = OpenPose(args.body_model_path, tryon_keypoints=True)
+
+    checked, mismatched = 0, []
+    for path in list_images(args.images):
+        image = Image.open(path).convert("RGB").resize((384, 512))
+        try:
+            expected = full(image)["pose_keypoints_2d"]
+        except IndexError:
+            # full mode fails when nobody is found
+            logger.info("{}: no person in full mode, skipped".format(path))
+            continue
+        actual = tryon(image)["pose_keypoints_2d"]
+        expected = np.array([expected[i][:2] for i in TRYON_JOINTS], dtype=np.float64)
+        actual = np.array([actual[i][:2] for i in TRYON_JOINTS], dtype=np.float64)
+        checked += 1
+        if not np.array_equal(expected, actual):
+            joints = [TRYON_JOINTS[i] for i in np.nonzero((expected != actual).any(axis=1))[0]]
+            logger.info("{}: joints {} differ\n  full  {}\n  tryon {}".format(
+                path, joints, expected.tolist(), actual.tolist()))
+            mismatched.append(path)
+
+    assert checked, "no image with a person"
+    logger.info("{} of {} images differ on joints 1-7".format(len(mismatched), checked))
+    assert len(mismatched) <= args.max_mismatch * checked, "try-on keypoints diverge from the full body mode"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Export the OpenPose body model to ONNX, optionally int8 quantized
+"""
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT.parents[1]))
+
+import argparse
+import logging
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+from preprocess.openpose.annotator.util import resize_image, HWC3
+from preprocess.openpose.annotator.openpose.body import Body, prepare_input
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# same single scale as Body.__call__
+BOXSIZE = 368
+SCALE = 0.5
+
+
+def export(body_model_path, output_path, opset_version=13):
+    model = Body(body_model_path).model.cpu().eval()
+    # 512x384 try-on input at the Body scale
+    dummy = torch.zeros(1, 3, 184, 144)
+    # there is no batch norm in the body model, constant folding only folds the weight-side constants,
+    # ORT fuses Conv+Relu when the session is created
+    torch.onnx.export(
+        model, dummy, output_path,
+        input_names=["image"], output_names=["paf", "heatmap"],
+        dynamic_axes={"image": {2: "height", 3: "width"},
+                      "paf": {2: "height", 3: "width"},
+                      "heatmap": {2: "height", 3: "width"}},
+        opset_version=opset_version,
+        do_constant_folding=True,
+    )
+    logger.info("Exported {}".format(output_path))
+
+
+class CalibrationReader(object):
+    """Feeds person images through the Body preprocessing for static quantization."""
+
+    def __init__(self, image_dir, input_name="image", resolution=384):
+        self.inputs = []
+        for name in sorted(os.listdir(image_dir)):
+            if not name.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            image = HWC3(np.asarray(Image.open(os.path.join(image_dir, name)).convert("RGB")))
+            # OpenposeDetector feeds BGR
+            image = resize_image(image, resolution)[:, :, ::-1].copy()
+            im, _, _ = prepare_input(image, SCALE * BOXSIZE / image.shape[0])
+            self.inputs.append({input_name: im})
+        self.iterator = iter(self.inputs)
+
+    def get_next(self):
+        return next(self.iterator, None)
+
+    def rewind(self):
+        self.iterator = iter(self.inputs)
+
+
+def quantize(model_path, output_path, calibration_dir):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    preprocessed_path = output_path + ".pre.onnx"
+    quant_pre_process(model_path, preprocessed_path)
+    quantize_static(
+        preprocessed_path, output_path, CalibrationReader(calibration_dir),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(preprocessed_path)
+    logger.info("Quantized {}".format(output_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--body_model_path", default="./ckpts/openpose/body_pose_model.pth")
+    parser.add_argument("--output", default="./ckpts/openpose/body_pose_model.onnx")
+    parser.add_argument("--opset_version", type=int, default=13)
+    parser.add_argument("--calibration_dir", default=None,
+                        help="person images, enables int8 static quantization to <output>.int8.onnx")
+    args = parser.parse_args()
+
+    export(args.body_model_path, args.output, args.opset_version)
+    if args.calibration_dir is not None:
+        quantize(args.output, os.path.splitext(args.output)[0] + ".int8.onnx", args.calibration_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,8 +22,11 @@ import pdb
 # os.environ['CUDA_VISIBLE_DEVICES'] = '0,1,2,3'
 
 class OpenPose:
-    def __init__(self, body_model_path):
+    def __init__(self, body_model_path, tryon_keypoints=False):
+        # tryon_keypoints only detects the neck, shoulders, elbows and wrists read by the agnostic masks,
+        # the other joints are returned as [0, 0]
         self.preprocessor = OpenposeDetector(body_model_path)
+        self.tryon_keypoints = tryon_keypoints
 
     def __call__(self, input_image, resolution=384):
         if isinstance(input_image, Image.Image):
@@ -37,6 +40,15 @@ class OpenPose:
             input_image = resize_image(input_image, resolution)
             H, W, C = input_image.shape
             assert (H == 512 and W == 384), 'Incorrect input image shape'
+            if self.tryon_keypoints:
+                pose = self.preprocessor(input_image, hand_and_face=False, return_is_index=True,
+                                         tryon_keypoints=True)
+                candidate = pose['bodies']['candidate']
+                subset = pose['bodies']['subset'][0][:18] if pose['bodies']['subset'] else [-1] * 18
+                keypoints = [[candidate[int(i)][0] * 384, candidate[int(i)][1] * 512] if i != -1 else [0, 0]
+                             for i in subset]
+                return {"pose_keypoints_2d": keypoints}
+
             pose, detected_map = self.preprocessor(input_image, hand_and_face=False)
 
             candidate = pose['bodies']['candidate']